@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for unicode_replacer.py
+Generates synthetic corpora and times each stage of the tool separately
+
+Results are written as JSON so runs from different commits can be compared:
+
+  python TestEnvironment/benchmark_replacer.py --output before.json
+  git checkout my-branch
+  python TestEnvironment/benchmark_replacer.py --output after.json --compare before.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import importlib.util
+from contextlib import redirect_stdout
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+HERE = Path(__file__).resolve().parent
+ROOT = HERE.parent
+
+# TestEnvironment/unicode_replacer.py only forwards to the script in the
+# repository root; import that one (worker processes inherit this path order)
+sys.path.insert(0, str(ROOT))
+import unicode_replacer as replacer
+
+def _load_module(name: str, path: Path):
+    """Import a module by file path (for the hyphenated create-test-files.py)"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+test_files = _load_module('create_test_files', HERE / 'create-test-files.py')
+
+# Characters injected into the corpus: every mapped character plus some that
+# fall back to [U+XXXX]
+UNMAPPED_SAMPLES = ['é', 'ß', '中', '文', '😀', '🙂', 'Ω', '\u00a0']
+UNICODE_POOL = sorted(
+    {char for char in replacer.REPLACEMENTS if len(char) == 1 and ord(char) > 127} | set(UNMAPPED_SAMPLES)
+)
+
+def _ascii_template_lines() -> List[str]:
+    """PowerShell-looking ASCII lines taken from the create-test-files.py content"""
+    lines = []
+    for content in test_files.files.values():
+        for line in content.splitlines():
+            line = ''.join(char for char in line if ord(char) < 128).rstrip()
+            if line.strip():
+                lines.append(line)
+    return lines
+
+TEMPLATE_LINES = _ascii_template_lines()
+
+def generate_text(size: int, density: float, rng: random.Random) -> str:
+    """Build roughly `size` characters of script text with `density` non-ASCII characters"""
+    lines = []
+    length = 0
+    while length < size:
+        line = rng.choice(TEMPLATE_LINES)
+        lines.append(line)
+        length += len(line) + 1
+    chars = list('\n'.join(lines)[:size])
+    for _ in range(int(len(chars) * density)):
+        chars[rng.randrange(len(chars))] = rng.choice(UNICODE_POOL)
+    return ''.join(chars)
+
+def generate_corpus(directory: Path, file_count: int, size: int, density: float, seed: int) -> int:
+    """Write file_count generated .ps1 files into directory, returning total bytes"""
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    total = 0
+    for i in range(file_count):
+        # Spread files over subdirectories like a real tree
+        filepath = directory / f'dir{i % 16:02d}' / f'script-{i:05d}.ps1'
+        filepath.parent.mkdir(exist_ok=True)
+        data = generate_text(size, density, rng).encode('utf-8')
+        filepath.write_bytes(data)
+        total += len(data)
+    return total
+
+def best_time(func: Callable, repeat: int, setup: Callable = None) -> float:
+    """Best wall-clock time of func over repeat runs"""
+    best = float('inf')
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_functions(sizes: List[int], densities: List[float], repeat: int, seed: int) -> List[Dict]:
+    """Time find_unicode_chars, replace_unicode and verify_ascii on in-memory text"""
+    results = []
+    for size in sizes:
+        for density in densities:
+            text = generate_text(size, density, random.Random(seed))
+            replaced, _ = replacer.replace_unicode(text)
+            nbytes = len(text.encode('utf-8'))
+            cases = {
+                'find_unicode_chars': lambda: replacer.find_unicode_chars(text),
+                'replace_unicode': lambda: replacer.replace_unicode(text),
+                'verify_ascii': lambda: replacer.verify_ascii(replaced),
+            }
+            for name, func in cases.items():
+                seconds = best_time(func, repeat)
+                results.append({
+                    'benchmark': name,
+                    'size': size,
+                    'density': density,
+                    'bytes': nbytes,
+                    'seconds': seconds,
+                    'mb_per_s': nbytes / seconds / 1e6 if seconds else None,
+                })
+                print(f"  {name:<20} size={size:<9} density={density:<6} {seconds * 1000:9.3f}ms")
+    return results
+
+def bench_end_to_end(file_counts: List[int], sizes: List[int], densities: List[float],
+                     repeat: int, seed: int, jobs: int, work_dir: Path) -> List[Dict]:
+    """Time main() over a generated tree; files are regenerated before every run"""
+    results = []
+    for file_count in file_counts:
+        for size in sizes:
+            for density in densities:
+                pristine = work_dir / 'pristine'
+                target = work_dir / 'target'
+                shutil.rmtree(pristine, ignore_errors=True)
+                nbytes = generate_corpus(pristine, file_count, size, density, seed)
+
+                def reset():
+                    shutil.rmtree(target, ignore_errors=True)
+                    shutil.copytree(pristine, target)
+
+                def run():
+                    with redirect_stdout(io.StringIO()):
+                        replacer.main([str(target), '--no-backup', '--jobs', str(jobs)])
+
+                seconds = best_time(run, repeat, setup=reset)
+                results.append({
+                    'benchmark': 'main',
+                    'files': file_count,
+                    'size': size,
+                    'density': density,
+                    'jobs': jobs,
+                    'bytes': nbytes,
+                    'seconds': seconds,
+                    'mb_per_s': nbytes / seconds / 1e6 if seconds else None,
+                    'files_per_s': file_count / seconds if seconds else None,
+                })
+                print(f"  main files={file_count:<6} size={size:<9} density={density:<6} "
+                      f"{seconds * 1000:9.1f}ms")
+    return results
+
+class LatencyOpener:
+    """open() stand-in that sleeps before every open, like a share on a slow network"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def __call__(self, path, mode='r'):
+        time.sleep(self.latency)
+        return open(path, mode)
+
+def bench_io_latency(latencies: List[float], file_count: int, size: int, density: float,
+                     repeat: int, seed: int, io_threads: int, work_dir: Path) -> List[Dict]:
+    """Compare serial processing with the asyncio pipeline when every read waits latency seconds"""
+    results = []
+    corpus = work_dir / 'latency'
+    shutil.rmtree(corpus, ignore_errors=True)
+    nbytes = generate_corpus(corpus, file_count, size, density, seed)
+    files = sorted(corpus.rglob('*.ps1'))
+    for latency in latencies:
+        opener = LatencyOpener(latency)
+        cases = {
+            'serial': lambda: list(replacer.process_files(files, preview_only=True, opener=opener)),
+            'pipelined': lambda: list(replacer.process_files_pipelined(files, io_threads=io_threads,
+                                                                       preview_only=True, opener=opener)),
+        }
+        for name, func in cases.items():
+            seconds = best_time(func, repeat)
+            results.append({
+                'benchmark': f'io_{name}',
+                'files': file_count,
+                'size': size,
+                'density': density,
+                'latency': latency,
+                'io_threads': io_threads if name == 'pipelined' else None,
+                'bytes': nbytes,
+                'seconds': seconds,
+                'files_per_s': file_count / seconds if seconds else None,
+            })
+            print(f"  io_{name:<16} files={file_count:<6} latency={latency * 1000:g}ms {seconds * 1000:9.1f}ms")
+    return results
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def _result_key(result: Dict) -> tuple:
+    return tuple((key, result.get(key)) for key in ('benchmark', 'files', 'size', 'density', 'jobs', 'latency'))
+
+def compare(baseline: Dict, current: Dict):
+    """Print per-benchmark speedups of current relative to baseline"""
+    previous = {_result_key(result): result for result in baseline['results']}
+    print(f"\nComparison against {baseline['meta'].get('commit') or 'baseline'} (>1.00x is faster)")
+    for result in current['results']:
+        old = previous.get(_result_key(result))
+        if not old or not result['seconds']:
+            continue
+        label = ', '.join(f'{key}={value}' for key, value in _result_key(result)[1:] if value is not None)
+        print(f"  {result['benchmark']:<20} {label:<45} {old['seconds'] / result['seconds']:6.2f}x")
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(',')]
+
+def _float_list(value: str) -> List[float]:
+    return [float(item) for item in value.split(',')]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark unicode_replacer.py on synthetic corpora')
+    parser.add_argument('--files', type=_int_list, default=[10, 200], help='File counts for main() (default: 10,200)')
+    parser.add_argument('--sizes', type=_int_list, default=[4096, 262144],
+                        help='File sizes in characters (default: 4096,262144)')
+    parser.add_argument('--densities', type=_float_list, default=[0.0, 0.001, 0.05],
+                        help='Fraction of non-ASCII characters (default: 0,0.001,0.05)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case; the best is kept (default: 3)')
+    parser.add_argument('--jobs', type=int, default=1, help='--jobs passed to main() (default: 1)')
+    parser.add_argument('--seed', type=int, default=1234, help='Corpus random seed (default: 1234)')
+    parser.add_argument('--skip-main', action='store_true', help='Only time the individual functions')
+    parser.add_argument('--io-latency', type=_float_list, default=[],
+                        help='Also compare serial and pipelined I/O with this many ms injected per file open, '
+                             'e.g. 5,20 (default: off)')
+    parser.add_argument('--io-threads', type=int, default=replacer.PIPELINE_IO_THREADS,
+                        help=f'io_threads for the pipelined case (default: {replacer.PIPELINE_IO_THREADS})')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    parser.add_argument('--compare', help='Previous JSON results to compare against')
+    args = parser.parse_args(argv)
+
+    print("Function timings")
+    results = bench_functions(args.sizes, args.densities, args.repeat, args.seed)
+    with tempfile.TemporaryDirectory(prefix='unicode-bench-') as work_dir:
+        if not args.skip_main:
+            print("End-to-end timings")
+            results += bench_end_to_end(args.files, args.sizes, args.densities,
+                                        args.repeat, args.seed, args.jobs, Path(work_dir))
+        if args.io_latency:
+            print("Slow filesystem timings")
+            results += bench_io_latency([ms / 1000 for ms in args.io_latency], max(args.files), min(args.sizes),
+                                        max(args.densities), args.repeat, args.seed, args.io_threads, Path(work_dir))
+
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), report)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
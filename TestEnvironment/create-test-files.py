@@ -4,9 +4,8 @@
 import os
 
 test_dir = r"C:\code\UnicodeReplacementTool\TestEnvironment\ComprehensiveTest"
-os.makedirs(test_dir, exist_ok=True)
 
-# Test files
+# Test files (also used as corpus templates by benchmark_replacer.py)
 files = {
     "test-empty.ps1": "",
     "test-only-unicode.ps1": "✓✗⚠🚀💡",
@@ -48,10 +47,12 @@ Write-Host "Start→Middle→End"
 """
 }
 
-for filename, content in files.items():
-    filepath = os.path.join(test_dir, filename)
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write(content)
-    print(f"Created: {filename}")
+if __name__ == '__main__':
+    os.makedirs(test_dir, exist_ok=True)
+    for filename, content in files.items():
+        filepath = os.path.join(test_dir, filename)
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write(content)
+        print(f"Created: {filename}")
 
-print("Test files created successfully!")
\ No newline at end of file
+    print("Test files created successfully!")
\ No newline at end of file
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Tests for unicode_replacer.py
+
+Run from the repository root:
+
+  python -m pytest -q Tests
+"""
+
+import io
+import sys
+import errno
+import codecs
+import shutil
+import subprocess
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+import unicode_replacer as replacer
+
+
+def test_jobs_with_redirected_stdout(tmp_path):
+    for index in range(4):
+        (tmp_path / f'script{index}.ps1').write_text(f'Write-Host "Done ✓ {index}"\n', encoding='utf-8')
+    output = io.StringIO()
+    with redirect_stdout(output):
+        code = replacer.main([str(tmp_path), '--jobs', '2', '--no-backup'])
+    assert code == 0
+    for index in range(4):
+        assert (tmp_path / f'script{index}.ps1').read_bytes() == f'Write-Host "Done [OK] {index}"\n'.encode()
+
+
+def test_replacer_process_paths_with_jobs(tmp_path, monkeypatch):
+    (tmp_path / 'a.ps1').write_text('→ a\n', encoding='utf-8')
+    (tmp_path / 'b.ps1').write_text('b ✓\n', encoding='utf-8')
+    monkeypatch.setattr(sys, 'stdout', io.StringIO())
+    results = dict(replacer.Replacer().process_paths([tmp_path], jobs=2, create_backup=False))
+    assert [results[tmp_path / name]['status'] for name in ('a.ps1', 'b.ps1')] == ['success', 'success']
+    assert (tmp_path / 'a.ps1').read_text() == '-> a\n'
+    assert (tmp_path / 'b.ps1').read_text() == 'b [OK]\n'
+
+
+def test_missing_explicit_mapping_is_an_error(tmp_path):
+    script = tmp_path / 'script.ps1'
+    script.write_text('✓\n', encoding='utf-8')
+    output = io.StringIO()
+    with redirect_stdout(output):
+        code = replacer.main([str(script), '--no-backup', '--mapping', str(tmp_path / 'typo.json')])
+    assert code == 1
+    assert 'Error loading mapping' in output.getvalue()
+    assert script.read_text(encoding='utf-8') == '✓\n'
+
+
+def test_malformed_mapping_raises_value_error():
+    for document in (b'["x"]', b'{"replacements": ["x"]}', b'{"replacements": {"a": {"\\u2713": "ok"}, "b": "x"}}',
+                     b'{"replacements": {"a": {"\\u2713": 1}}}', b'{"replacements": '):
+        try:
+            replacer.load_mapping(document)
+        except ValueError:
+            continue
+        raise AssertionError(f'{document!r} was accepted')
+    assert replacer.load_mapping(b'{"replacements": {"a": {"\\u2713": "ok"}}}') == {'✓': 'ok'}
+    assert replacer.load_mapping(b'{"\\u2713": "ok"}') == {'✓': 'ok'}
+
+
+def test_malformed_mapping_is_reported(tmp_path):
+    mapping = tmp_path / 'mapping.json'
+    mapping.write_text('{"replacements": ["x"]}', encoding='utf-8')
+    output = io.StringIO()
+    with redirect_stdout(output):
+        code = replacer.main([str(tmp_path), '--preview', '--mapping', str(mapping)])
+    assert code == 1
+    assert 'Error loading mapping' in output.getvalue()
+
+
+def test_sparse_and_dense_utf8_take_matching_paths():
+    sparse = ('Write-Host "ok"\n' * 200 + 'Done ✓ 👩🏽‍💻\n').encode('utf-8')
+    dense = ('✓→é ⚠️ 中文 👩🏽‍💻\n' * 200).encode('utf-8')
+    assert replacer.non_ascii_density(sparse) <= replacer.BYTES_PATH_MAX_DENSITY
+    assert replacer.non_ascii_density(dense) > replacer.BYTES_PATH_MAX_DENSITY
+    for data in (sparse, dense):
+        result, content = replacer._scan_data(Path('script.ps1'), data)
+        text = data.decode('utf-8')
+        new_text, counts, _, _ = replacer.ENGINE.transform(text)
+        assert content == new_text.encode('ascii')
+        assert result['replacement_counts'] == counts
+        assert result['first_lines'] == replacer._offsets_to_lines(text, replacer.ENGINE.transform(text)[2])
+        assert replacer.Replacer().replace_bytes(data) == content
+
+
+def test_unmapped_rejects_cache(tmp_path, capsys):
+    for extra in (['--unmapped'], ['--unmapped-stubs', str(tmp_path / 'stubs.json')]):
+        try:
+            replacer.main([str(tmp_path), '--preview', '--cache'] + extra)
+        except SystemExit as e:
+            assert e.code == 2
+        else:
+            raise AssertionError('--cache was accepted with ' + extra[0])
+    assert '--unmapped cannot be combined' in capsys.readouterr().err
+
+
+def _watch_tree(root):
+    for directory in ('node_modules/m', 'vendor/v', 'build', 'src/build', '.git/objects', '.unicode_backups/objects'):
+        (root / directory).mkdir(parents=True)
+    (root / '.gitignore').write_text('/build/\n', encoding='utf-8')
+    rules_cache = {}
+    return lambda directory: replacer.pruned_dir(directory, root, ['vendor'], True, rules_cache)
+
+
+def test_polling_watcher_prunes_like_a_walk(tmp_path):
+    prune = _watch_tree(tmp_path)
+    for directory in ('vendor/v', 'src/build', 'node_modules/m'):
+        (tmp_path / directory / 'a.ps1').write_text('x', encoding='utf-8')
+    watcher = replacer.PollingWatcher(tmp_path, prune=prune)
+    assert sorted(path.relative_to(tmp_path).as_posix() for path in watcher._snapshot) == [
+        '.gitignore', 'src/build/a.ps1']
+
+
+def test_inotify_watcher_prunes_and_reports_failures(tmp_path, capsys):
+    prune = _watch_tree(tmp_path)
+    try:
+        watcher = replacer.InotifyWatcher(tmp_path, prune=prune)
+    except (OSError, AttributeError, TypeError):
+        return
+    try:
+        assert sorted(path.relative_to(tmp_path).as_posix() for path in watcher._dirs.values()) == [
+            '.', 'src', 'src/build']
+        watcher._watch_failed(tmp_path / 'src', errno.EACCES)
+        watcher._watch_failed(tmp_path / 'a', errno.ENOSPC)
+        watcher._watch_failed(tmp_path / 'b', errno.ENOSPC)
+        watcher._watch_failed(tmp_path / 'gone', errno.ENOENT)
+    finally:
+        watcher.close()
+    output = capsys.readouterr().out
+    assert 'cannot watch' in output and 'src' in output
+    assert output.count('watch limit reached') == 1
+    assert 'gone' not in output
+
+
+def _cache_entries(directory):
+    import json
+    return sorted(json.loads((directory / replacer.CACHE_FILENAME).read_text(encoding='utf-8'))['files'])
+
+
+def test_cache_drops_entries_of_deleted_files(tmp_path):
+    for name in ('a.ps1', 'b.ps1', 'c.ps1'):
+        (tmp_path / name).write_text('ok\n', encoding='utf-8')
+    with redirect_stdout(io.StringIO()):
+        replacer.main([str(tmp_path), '--preview', '--cache'])
+        assert _cache_entries(tmp_path) == ['a.ps1', 'b.ps1', 'c.ps1']
+        (tmp_path / 'b.ps1').rename(tmp_path / 'd.ps1')
+        # A partial run keeps what it did not look at
+        replacer.main([str(tmp_path / 'a.ps1'), '--preview', '--cache', str(tmp_path / replacer.CACHE_FILENAME)])
+        assert _cache_entries(tmp_path) == ['a.ps1', 'b.ps1', 'c.ps1']
+        replacer.main([str(tmp_path), '--preview', '--cache'])
+    assert _cache_entries(tmp_path) == ['a.ps1', 'c.ps1', 'd.ps1']
+
+
+SEQUENCE_MAPPING = {'α': 'a', 'β': 'b', 'αβ': 'AB', 'αβγ': 'ABC', '👩‍💻': '[DEV]', '⚠': '[W]', '⚠️': '[WARN]'}
+
+
+def _transform_both(engine, text):
+    """transform() result, checked against transform_bytes() on the UTF-8 encoding"""
+    new_text, counts, offsets, replacements = engine.transform(text)
+    new_data, byte_counts, _, byte_replacements = engine.transform_bytes(text.encode('utf-8'))
+    assert new_data == new_text.encode('ascii')
+    assert (byte_counts, byte_replacements) == (counts, replacements)
+    return new_text, counts, replacements
+
+
+def test_sequences_take_the_longest_match():
+    engine = replacer.ReplacementEngine(SEQUENCE_MAPPING)
+    new_text, counts, _ = _transform_both(engine, 'αβγ αβ αβδ β α')
+    assert new_text == 'ABC AB AB[U+03B4] b a'
+    assert counts == {'αβγ': 1, 'αβ': 2, 'δ': 1, 'β': 1, 'α': 1}
+    # Without the rest of a sequence, its prefix falls back per character
+    assert _transform_both(engine, 'αγ')[0] == 'a[U+03B3]'
+
+
+def test_sequences_step_over_modifiers():
+    engine = replacer.ReplacementEngine(SEQUENCE_MAPPING)
+    sequences = dict(engine.sequences)
+    new_text, counts, replacements = _transform_both(engine, '👩🏽‍💻 👩‍💻 αβ️γ ⚠️ ⚠')
+    assert new_text == '[DEV] [DEV] ABC [WARN] [W]'
+    assert replacements['👩🏽‍💻'] == '[DEV]'
+    assert counts['αβ️γ'] == 1
+    # A modifier outside any sequence is an ordinary unmapped character
+    assert _transform_both(engine, '👩🏽')[0] == '[U+1F469][U+1F3FD]'
+    # Variants are resolved without being added to the engine
+    assert engine.sequences == sequences
+    assert replacer.ReplacementEngine(SEQUENCE_MAPPING).lookup('👩🏿‍💻') == '[DEV]'
+
+
+def test_gitignore_negation_and_directory_rules(tmp_path):
+    # Expected files are what `git add -A` stages for the same tree
+    files = ['a.ps1', 'gen.ps1', 'keep.gen.ps1', 'build/x.ps1', 'src/build', 'src/y.ps1', 'src/build2/z.ps1',
+             'top.ps1', 'src/top.ps1', 'docs/deep/n.ps1', 'logs/l.ps1', 'logs/important/i.ps1',
+             'sub/a.ps1', 'sub/local.ps1', 'sub/nested/local.ps1', 'node_modules/m.ps1']
+    for name in files:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text('x', encoding='utf-8')
+    (tmp_path / '.gitignore').write_text(
+        '# generated\n*.gen.ps1\n!keep.gen.ps1\ngen.ps1\nbuild/\n/top.ps1\ndocs/**/n.ps1\nlogs/*\n!logs/important/\n',
+        encoding='utf-8')
+    (tmp_path / 'sub' / '.gitignore').write_text('/local.ps1\n', encoding='utf-8')
+    expected = ['a.ps1', 'keep.gen.ps1', 'logs/important/i.ps1', 'src/build', 'src/build2/z.ps1', 'src/top.ps1',
+                'src/y.ps1', 'sub/a.ps1', 'sub/nested/local.ps1']
+    include = ['*.ps1', 'build']
+    walked = [path.relative_to(tmp_path).as_posix() for path in replacer.walk_files(tmp_path, include)]
+    assert sorted(walked) == expected
+    listed = replacer.filter_paths([tmp_path / name for name in files], tmp_path, include, use_gitignore=True)
+    assert sorted(path.relative_to(tmp_path).as_posix() for path in listed) == expected
+    assert len(list(replacer.walk_files(tmp_path, include, use_gitignore=False))) == len(files) - 1
+
+
+ENCODING_CASES = [
+    ('utf-8 with BOM', codecs.BOM_UTF8 + '✓ é\n'.encode('utf-8'), b'[OK] [U+00E9]\n', 'utf-8'),
+    ('BOM but cp1252 content', codecs.BOM_UTF8 + b'\x93hi\x94 caf\xe9\n', b'"hi" caf[U+00E9]\n', 'cp1252'),
+    ('cp1252 with an undefined byte', b'\x93hi\x94 caf\xe9 \x81\n', b'"hi" caf[U+00E9] [U+0081]\n', 'cp1252'),
+    ('utf-16-le', codecs.BOM_UTF16_LE + '✓ é\n'.encode('utf-16-le'), b'[OK] [U+00E9]\n', 'utf-16-le'),
+]
+
+
+@pytest.mark.parametrize('mode', ['memory', 'stream', 'pipeline'])
+@pytest.mark.parametrize('name, data, expected, encoding', ENCODING_CASES, ids=[case[0] for case in ENCODING_CASES])
+def test_encoding_fallbacks(tmp_path, mode, name, data, expected, encoding):
+    script = tmp_path / 'script.ps1'
+    script.write_bytes(data)
+    options = dict(create_backup=False, stream_threshold=1 if mode == 'stream' else replacer.STREAM_THRESHOLD)
+    with redirect_stdout(io.StringIO()) as output:
+        if mode == 'pipeline':
+            [(_, result)] = replacer.process_files_pipelined([script], io_threads=2, **options)
+        else:
+            result = replacer.process_file(script, **options)
+    assert script.read_bytes() == expected
+    assert result['encoding'] == encoding
+    assert ('not valid UTF-8' in output.getvalue()) == (encoding == 'cp1252')
+
+
+STREAM_TEXT = 'Write-Host "✓ ok"\r\n# 👩🏽‍💻 at work ⚠️\n\n中文 é👩‍💻\n' * 3 + 'end ✓'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 7, 64])
+def test_stream_chunks_split_multibyte_runs(tmp_path, monkeypatch, chunk_size):
+    data = STREAM_TEXT.encode('utf-8')
+    in_memory, streamed = tmp_path / 'memory.ps1', tmp_path / 'stream.ps1'
+    in_memory.write_bytes(data)
+    streamed.write_bytes(data)
+    monkeypatch.setattr(replacer, 'STREAM_CHUNK_SIZE', chunk_size)
+    with redirect_stdout(io.StringIO()):
+        expected = replacer.process_file(in_memory, create_backup=False)
+        result = replacer.process_file(streamed, create_backup=False, stream_threshold=1)
+    assert streamed.read_bytes() == in_memory.read_bytes()
+    for key in ('replacement_counts', 'first_lines', 'unicode_count', 'bytes_out'):
+        assert result[key] == expected[key], key
+    assert dict(result['replacements']) == dict(expected['replacements'])
+    assert expected['first_lines']['👩🏽‍💻'] == 2 and expected['first_lines']['中'] == 4
+
+
+def test_line_index_positions():
+    text = 'a\nbé\n\n  ✓'
+    for content in (text, text.encode('utf-8')):
+        index = replacer.LineIndex(content)
+        find = (lambda char: content.find(char.encode('utf-8'))) if isinstance(content, bytes) else content.find
+        assert [index.position(find(char)) for char in ('é', '✓', 'a')] == [(2, 2), (4, 3), (1, 1)]
+
+
+DIFF_FILES = {
+    'crlf.ps1': 'one\r\ntwo ✓\r\nthree\r\nfour\r\nfive\r\nsix\r\nseven\r\neight ✓\r\n'.encode('utf-8'),
+    'no-newline.ps1': 'a\nb\nc ✓'.encode('utf-8'),
+    # The last line is only a BOM-like U+FEFF, which is removed with it
+    'vanishing-line.ps1': 'x ✓\n\ufeff'.encode('utf-8'),
+}
+
+
+def test_diff_crlf_and_missing_final_newline(tmp_path, monkeypatch):
+    for name, data in DIFF_FILES.items():
+        (tmp_path / name).write_bytes(data)
+    monkeypatch.chdir(tmp_path)
+    with redirect_stdout(io.StringIO()):
+        assert replacer.main(['.', '--diff', 'fix.patch']) == 0
+    patch = (tmp_path / 'fix.patch').read_bytes()
+    # Nothing is rewritten
+    assert all((tmp_path / name).read_bytes() == data for name, data in DIFF_FILES.items())
+    assert (b'@@ -1,8 +1,8 @@\n one\r\n-two \xe2\x9c\x93\r\n+two [OK]\r\n three\r\n four\r\n five\r\n six\r\n'
+            b' seven\r\n-eight \xe2\x9c\x93\r\n+eight [OK]\r\n') in patch
+    assert (b'@@ -1,3 +1,3 @@\n a\n b\n-c \xe2\x9c\x93\n\\ No newline at end of file\n'
+            b'+c [OK]\n\\ No newline at end of file\n') in patch
+    if shutil.which('git') is None:
+        return
+    # The patch must turn the originals into exactly what a rewrite produces
+    expected = {name: replacer._scan_data(Path(name), data)[1] for name, data in DIFF_FILES.items()}
+    subprocess.run(['git', 'apply', 'fix.patch'], cwd=tmp_path, check=True)
+    assert {name: (tmp_path / name).read_bytes() for name in DIFF_FILES} == expected
+    assert expected['vanishing-line.ps1'] == b'x [OK]\n'
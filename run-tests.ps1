@@ -18,20 +18,23 @@ Write-Host "`nTest 2: Known Unicode Replacement" -ForegroundColor Yellow
 $testContent = @"
 Write-Host "✓ Success"
 Write-Host "✗ Failed"  
+Write-Host "✘ Error"
 Write-Host "🚀 Deploy"
 "@
 
 $testFile = "test-temp.ps1"
+$testBackups = "test-temp-backups"
 [System.IO.File]::WriteAllText($testFile, $testContent, [System.Text.Encoding]::UTF8)
 
-# Run replacement
-& "C:\Program Files\Python313\python.exe" unicode_replacer.py $testFile | Out-Null
+# Run replacement, keeping its backup store apart from any real .unicode_backups
+& "C:\Program Files\Python313\python.exe" unicode_replacer.py $testFile --backup-dir $testBackups | Out-Null
 
 # Verify result
 $result = Get-Content $testFile -Raw
 $expected = @"
 Write-Host "[OK] Success"
 Write-Host "[FAIL] Failed"  
+Write-Host "[ERROR] Error"
 Write-Host "[DEPLOY] Deploy"
 "@
 
@@ -47,7 +50,7 @@ if ($result.Trim() -eq $expected.Trim()) {
 
 # Cleanup
 Remove-Item $testFile -Force
-Remove-Item "$testFile.backup_*" -Force
+Remove-Item $testBackups -Recurse -Force
 
 # Test 3: ASCII verification
 Write-Host "`nTest 3: ASCII Compliance" -ForegroundColor Yellow
@@ -4,14 +4,89 @@ Unicode Replacement Tool - Production Version
 Reliably replaces Unicode characters with ASCII equivalents in PowerShell scripts
 """
 
+import io
 import os
+import re
 import sys
 import json
+import codecs
+import marshal
+import stat
+import errno
+import time
+import queue
+import struct
+import hashlib
+import fnmatch
+import asyncio
 import argparse
+import cProfile
+import contextlib
+import tempfile
+import unicodedata
+import subprocess
+import threading
+from bisect import bisect_right
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain, islice
 from pathlib import Path
 import shutil
 from datetime import datetime
-from typing import Dict, List, Tuple, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Optional, Union
+
+# Files at least this large are streamed in chunks instead of read into memory
+STREAM_THRESHOLD = 64 * 1024 * 1024
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Longest non-ASCII run carried between chunks so sequences are not split
+SEQUENCE_CARRY_LIMIT = 256
+
+# UTF-8 content is replaced as bytes while at most this share of its bytes
+# start a non-ASCII character; denser text is faster decoded to str
+BYTES_PATH_MAX_DENSITY = 0.01
+# Larger content is sampled for that share in this many evenly spaced windows
+DENSITY_SAMPLE_WINDOWS = 8
+DENSITY_SAMPLE_SIZE = 8 * 1024
+
+# --check reads files in blocks of this size, stopping at the first high-bit byte
+CHECK_BLOCK_SIZE = 64 * 1024
+# Exit code when --check finds non-ASCII content (1 is reserved for errors)
+EXIT_UNICODE_FOUND = 3
+
+# Asyncio pipeline: files in flight (and threads doing their I/O) at once
+PIPELINE_IO_THREADS = 16
+
+# Watch mode: quiet period before a changed file is processed
+WATCH_DEBOUNCE = 0.05
+WATCH_POLL_INTERVAL = 1.0
+# Latency percentiles cover this many of the most recent files
+WATCH_LATENCY_SAMPLES = 10000
+
+# Content-addressed backup store, created in the root of the processed tree
+BACKUP_DIRNAME = '.unicode_backups'
+
+# Incremental re-run index, stored in the root of the processed tree
+CACHE_FILENAME = '.unicode_replacer_cache.json'
+CACHE_VERSION = 1
+# Files modified this close to the index write are re-hashed: a change in the
+# same timestamp tick would not show in mtime (2s covers FAT's granularity)
+CACHE_RACY_NS = 2 * 10**9
+
+# Shared mapping file, layered over REPLACEMENTS; the compiled table is cached
+# beside it so that startup skips parsing and compiling
+MAPPING_PATH = Path(__file__).resolve().parent / 'Config' / 'UnicodeReplacements.json'
+MAPPING_CACHE_SUFFIX = '.cache'
+MAPPING_CACHE_VERSION = 2
+
+# Machine-readable output formats for --report
+REPORT_FORMATS = ('ndjson', 'json')
+
+# --unmapped: characters listed, and sample lines kept per character
+UNMAPPED_TOP = 20
+UNMAPPED_SAMPLES = 3
+
+# Unchanged lines shown around each change by --diff, as in diff -u
+DIFF_CONTEXT = 3
 
 # Comprehensive Unicode to ASCII replacement mappings
 REPLACEMENTS = {
@@ -61,6 +136,7 @@ REPLACEMENTS = {
     '🎉': '[CELEBRATE]',
     '🔄': '[REFRESH]',
     '🤖': '[BOT]',
+    '❤': '[HEART]',
     '█': '[BLOCK]',
     '\ufeff': '',  # BOM character - remove it
     '\ufe0f': '',  # Variation selector - remove it
@@ -157,126 +233,2648 @@ REPLACEMENTS = {
     '⅞': '7/8',
     '⅑': '1/9',
     '⅒': '1/10',
+    
+    # Emoji modifiers: skin tones, keycap and the joiner of unmapped sequences
+    '\U0001F3FB': '',
+    '\U0001F3FC': '',
+    '\U0001F3FD': '',
+    '\U0001F3FE': '',
+    '\U0001F3FF': '',
+    '\u20e3': '',
+    '\u200d': '',
+    
+    # Multi-code-point sequences, replaced as a whole (longest match wins)
+    '\u26a0\ufe0f': '[WARNING]',
+    '\u2764\ufe0f': '[HEART]',
+    '👨\u200d💻': '[DEVELOPER]',
+    '👩\u200d💻': '[DEVELOPER]',
+    '🧑\u200d💻': '[DEVELOPER]',
+    '👨\u200d🔧': '[MECHANIC]',
+    '👩\u200d🔧': '[MECHANIC]',
+    '🧑\u200d🔧': '[MECHANIC]',
+    '👨\u200d🔬': '[SCIENTIST]',
+    '👩\u200d🔬': '[SCIENTIST]',
+    '🧑\u200d🔬': '[SCIENTIST]',
+    '🏳\ufe0f\u200d🌈': '[RAINBOW_FLAG]',
+    '🏴\u200d☠\ufe0f': '[PIRATE_FLAG]',
 }
 
+# Skin tones and the emoji variation selector may appear inside a sequence
+# without being part of its mapping key
+SEQUENCE_MODIFIERS = frozenset('\ufe0f\U0001F3FB\U0001F3FC\U0001F3FD\U0001F3FE\U0001F3FF')
+
+NEWLINE_RE = re.compile('\n')
+NEWLINE_BYTES_RE = re.compile(b'\n')
+# Splits text into alternating ASCII spans and maximal non-ASCII runs
+NON_ASCII_SPLIT_RE = re.compile(r'([^\x00-\x7f]+)')
+# In UTF-8 every non-ASCII character is encoded with high-bit bytes only, so
+# these runs are exactly the encoded non-ASCII runs
+HIGH_BIT_RUN_RE = re.compile(rb'[\x80-\xff]+')
+
+def non_ascii_runs(text: str) -> List[Tuple[int, int]]:
+    """(start, end) of every maximal run of non-ASCII characters in text.
+
+    The text is encoded as ASCII: the codec skips ASCII in C and hands each
+    whole run to the error handler, which only records where it is.
+    """
+    runs = []
+    
+    def collect_run(error: UnicodeEncodeError) -> Tuple[str, int]:
+        runs.append((error.start, error.end))
+        return '', error.end
+    
+    _run_handler.handler = collect_run
+    try:
+        text.encode('ascii', errors=_RUN_ERRORS)
+    finally:
+        _run_handler.handler = None
+    return runs
+
+class LineIndex:
+    """Maps offsets in a text to 1-based (line, column) by bisecting line starts.
+
+    Line starts are collected with one regex scan per block, only as far
+    into the text as offsets have been asked for. Each line's context
+    string is built once, however many hits the line has. The text may
+    also be bytes, split at b'\\n'.
+    """
+    # Offsets are indexed at least this far ahead, doubling as the index grows
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, text: Union[str, bytes]):
+        self.text = text
+        self.starts = [0]
+        self._indexed = 0
+        self._contexts = {}
+        self._newline = b'\n' if isinstance(text, bytes) else '\n'
+        self._newline_re = NEWLINE_BYTES_RE if isinstance(text, bytes) else NEWLINE_RE
+
+    def _index_to(self, offset: int):
+        """Record every line start up to and including offset"""
+        if offset < self._indexed:
+            return
+        end = min(len(self.text), max(offset + 1, self._indexed * 2, self.BLOCK_SIZE))
+        self.starts.extend(match.end() for match in self._newline_re.finditer(self.text, self._indexed, end))
+        self._indexed = end
+
+    def line(self, offset: int) -> int:
+        self._index_to(offset)
+        return bisect_right(self.starts, offset)
+
+    def position(self, offset: int) -> Tuple[int, int]:
+        """(line, column) of offset, both 1-based"""
+        line = self.line(offset)
+        return line, offset - self.starts[line - 1] + 1
+
+    def span(self, line: int) -> Tuple[int, int]:
+        """Start and end offsets of a line whose start is indexed, without its newline"""
+        start = self.starts[line - 1]
+        if line < len(self.starts):
+            return start, self.starts[line] - 1
+        end = self.text.find(self._newline, start)
+        return start, len(self.text) if end < 0 else end
+
+    def lines(self, first: int, last: int) -> list:
+        """Lines first to last with their newlines, stopping early at the end of the text"""
+        while len(self.starts) <= last and self._indexed < len(self.text):
+            self._index_to(self._indexed)
+        lines = []
+        for line in range(first, min(last, len(self.starts)) + 1):
+            start = self.starts[line - 1]
+            if start == len(self.text):
+                break
+            lines.append(self.text[start:self.starts[line] if line < len(self.starts) else len(self.text)])
+        return lines
+
+    def context(self, line: int) -> str:
+        """The stripped line, cut to 50 characters"""
+        context = self._contexts.get(line)
+        if context is None:
+            start, end = self.span(line)
+            context = self._contexts[line] = _clip_context(self.text[start:end])
+        return context
+
+def _clip_context(line: str) -> str:
+    """A line as shown next to a hit: stripped and cut to 50 characters"""
+    line = line.strip()
+    return line[:50] + ('...' if len(line) > 50 else '')
+
+def _context_at(text: Union[str, bytes], offset: int) -> str:
+    """The clipped line containing offset, in text or in UTF-8 bytes"""
+    newline = b'\n' if isinstance(text, bytes) else '\n'
+    start = text.rfind(newline, 0, offset) + 1
+    end = text.find(newline, offset)
+    line = text[start:end if end >= 0 else len(text)]
+    return _clip_context(line.decode('utf-8') if isinstance(line, bytes) else line)
+
+class UnicodeHit:
+    """Location of one non-ASCII character; the context string is built on demand"""
+    __slots__ = ('char', 'line', 'column', '_index')
+
+    def __init__(self, char: str, line: int, column: int, index: LineIndex):
+        self.char = char
+        self.line = line
+        self.column = column
+        self._index = index
+
+    @property
+    def code(self) -> str:
+        return f'U+{ord(self.char):04X}'
+
+    @property
+    def context(self) -> str:
+        return self._index.context(self.line)
+
+    def as_dict(self) -> Dict:
+        return {
+            'char': self.char,
+            'line': self.line,
+            'column': self.column,
+            'code': self.code,
+            'context': self.context
+        }
+
+def iter_unicode_chars(text: str, index: Optional[LineIndex] = None) -> Iterator[UnicodeHit]:
+    """Lazily yield the location of each non-ASCII character in text"""
+    index = index or LineIndex(text)
+    for start, end in non_ascii_runs(text):
+        # Newlines are ASCII, so a run lies within one line: one lookup per run
+        line, column = index.position(start)
+        for pos in range(start, end):
+            yield UnicodeHit(text[pos], line, column + pos - start, index)
+
 def find_unicode_chars(text: str) -> List[Dict]:
     """Find all non-ASCII characters in text"""
-    unicode_chars = []
-    lines = text.split('\n')
-    
-    for line_num, line in enumerate(lines, 1):
-        for col_num, char in enumerate(line, 1):
-            if ord(char) > 127:
-                unicode_chars.append({
-                    'char': char,
-                    'line': line_num,
-                    'column': col_num,
-                    'code': f'U+{ord(char):04X}',
-                    'context': line.strip()[:50] + ('...' if len(line.strip()) > 50 else '')
-                })
-    
-    return unicode_chars
+    return [hit.as_dict() for hit in iter_unicode_chars(text)]
+
+# Byte order marks checked before anything else. The BOM is decoded along with
+# the text as U+FEFF, which the mapping removes.
+BOM_ENCODINGS = [
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+]
+FALLBACK_ENCODING = 'cp1252'
+
+def _latin1_errors(error: UnicodeDecodeError) -> Tuple[str, int]:
+    """Decode the five bytes cp1252 leaves undefined as their Latin-1 code points"""
+    return error.object[error.start:error.end].decode('latin-1'), error.end
+
+codecs.register_error('unicode_replacer.latin1', _latin1_errors)
+
+# Error handlers are registered globally; the run handler of the
+# transform_bytes or non_ascii_runs call in progress on this thread is kept here
+_run_handler = threading.local()
+
+def _run_errors(error: UnicodeError) -> Tuple[str, int]:
+    """Pass a non-ASCII run met by the ASCII codec to the current run handler"""
+    return _run_handler.handler(error)
+
+# Unique per module instance: a second import (e.g. as __main__ and by name)
+# must not redirect this copy's calls to the other copy's handler
+_RUN_ERRORS = f'unicode_replacer.runs_{id(_run_handler):x}'
+codecs.register_error(_RUN_ERRORS, _run_errors)
+
+def sniff_encoding(head: bytes) -> Optional[str]:
+    """Return the encoding announced by a byte order mark, if any"""
+    for bom, encoding in BOM_ENCODINGS:
+        if head.startswith(bom):
+            return encoding
+    return None
+
+_UTF8_LEAD_BYTES = bytes(range(0xc0, 0x100))
+
+def non_ascii_density(data: bytes) -> float:
+    """Estimate the share of bytes in UTF-8 data that start a non-ASCII character.
+
+    Content up to DENSITY_SAMPLE_WINDOWS windows long is counted whole,
+    anything longer from evenly spaced windows.
+    """
+    if len(data) > DENSITY_SAMPLE_WINDOWS * DENSITY_SAMPLE_SIZE:
+        stride = len(data) // DENSITY_SAMPLE_WINDOWS
+        data = b''.join(data[start:start + DENSITY_SAMPLE_SIZE]
+                        for start in range(0, stride * DENSITY_SAMPLE_WINDOWS, stride))
+    if not data:
+        return 0.0
+    return (len(data) - len(data.translate(None, _UTF8_LEAD_BYTES))) / len(data)
+
+def decode_bytes(data: bytes) -> Tuple[str, str]:
+    """Decode file content without re-reading it, returning (text, encoding).
+
+    Tries, in order: a BOM (UTF-8, UTF-16 LE/BE), strict UTF-8, then cp1252
+    with Latin-1 for its undefined bytes. The last step cannot fail, so
+    legacy Windows text keeps its real characters instead of U+FFFD. A
+    UTF-8 BOM does not exempt the rest from the strict check; only UTF-16,
+    which has no fallback, decodes invalid units as U+FFFD.
+    """
+    encoding = sniff_encoding(data)
+    if encoding is not None and encoding != 'utf-8':
+        return data.decode(encoding, errors='replace'), encoding
+    try:
+        return data.decode('utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    # A UTF-8 BOM stays U+FEFF (which the mapping removes) ahead of the legacy text
+    bom = '\ufeff' if encoding == 'utf-8' else ''
+    body = data[len(codecs.BOM_UTF8):] if bom else data
+    return bom + body.decode(FALLBACK_ENCODING, errors='unicode_replacer.latin1'), FALLBACK_ENCODING
+
+def fallback_replacement(char: str) -> str:
+    """ASCII placeholder used for characters without a mapping"""
+    return f'[U+{ord(char):04X}]'
+
+def is_fallback(token: str, replacement: str) -> bool:
+    """True if a character was replaced by its placeholder, i.e. it has no mapping"""
+    return len(token) == 1 and replacement == fallback_replacement(token)
+
+class _TranslationTable(dict):
+    """str.translate table that fills in placeholders for unmapped code points"""
+
+    def __missing__(self, code_point: int) -> str:
+        replacement = self[code_point] = f'[U+{code_point:04X}]'
+        return replacement
+
+def describe_codes(token: str) -> str:
+    """ASCII rendering of a character or sequence, e.g. [U+26A0][U+FE0F]"""
+    return ''.join(f'[U+{ord(char):04X}]' for char in token)
+
+class ReplacementEngine:
+    """Replacement mapping compiled into a str.translate table.
+
+    Built once and reused for every file. transform() makes a single regex
+    split of a document into ASCII spans and non-ASCII runs. ASCII passes
+    through untouched, and each distinct run is translated and counted
+    once however often it occurs. Every replacement is checked to be ASCII
+    here, so the output is ASCII by construction.
+
+    Keys of several non-ASCII characters (emoji with variation selectors,
+    ZWJ sequences) go into a trie instead. Runs that contain the first
+    character of a sequence are scanned once, left to right, taking the
+    longest sequence at each position; everything else is translated per
+    character as before.
+
+    transform_bytes() does the same work on UTF-8 bytes, so sparse files in
+    the common encoding are never decoded as a whole. Its error handler runs
+    once per non-ASCII run, so above BYTES_PATH_MAX_DENSITY (see
+    non_ascii_density) decoding and calling transform() is faster.
+    """
+
+    def __init__(self, replacements: Dict[str, str]):
+        # Single non-ASCII characters go in the translate table, all-non-ASCII
+        # sequences in the trie; anything containing ASCII is never matched
+        self.table = _TranslationTable(
+            (ord(char), replacement)
+            for char, replacement in replacements.items()
+            if len(char) == 1 and ord(char) > 127
+        )
+        self.sequences = {
+            key: replacement
+            for key, replacement in replacements.items()
+            if len(key) > 1 and NON_ASCII_SPLIT_RE.fullmatch(key)
+        }
+        for key, replacement in chain(((chr(code_point), replacement) for code_point, replacement in self.table.items()),
+                                      self.sequences.items()):
+            if not replacement.isascii():
+                raise ValueError(f"Replacement for {describe_codes(key)} is not ASCII: {replacement!r}")
+        # Identifies the effective mapping, so cached scan results can be invalidated
+        self.fingerprint = hashlib.blake2b(
+            json.dumps([sorted(self.table.items()), sorted(self.sequences.items())]).encode('ascii'),
+            digest_size=16
+        ).hexdigest()
+        self._build_trie()
+
+    @classmethod
+    def from_table(cls, table: Dict[int, str], sequences: Dict[str, str], fingerprint: str) -> 'ReplacementEngine':
+        """Rebuild an engine from an already validated table (see load_engine)"""
+        engine = cls.__new__(cls)
+        engine.table = _TranslationTable(table)
+        engine.sequences = sequences
+        engine.fingerprint = fingerprint
+        engine._build_trie()
+        return engine
+
+    def _build_byte_table(self) -> Dict[bytes, Tuple[str, bytes]]:
+        """UTF-8 encoding of each mapped character -> (character, replacement)"""
+        self._byte_table = {
+            chr(code_point).encode('utf-8'): (chr(code_point), replacement)
+            for code_point, replacement in self.table.items()
+            # Lone surrogates are not valid UTF-8; such files take the str path
+            if not 0xD800 <= code_point <= 0xDFFF
+        }
+        return self._byte_table
+
+    def _build_trie(self):
+        """Index the sequences by character; a None key marks the end of one"""
+        self._trie = {}
+        for key, replacement in self.sequences.items():
+            node = self._trie
+            for char in key:
+                node = node.setdefault(char, {})
+            node[None] = replacement
+        # Cheap test for whether a run needs the trie at all
+        self._sequence_start_re = (
+            re.compile('[' + ''.join(re.escape(char) for char in self._trie) + ']') if self._trie else None
+        )
+        # Built on first use by transform_bytes
+        self._byte_table = None
+
+    def lookup(self, token: str) -> str:
+        """Return the ASCII replacement for a non-ASCII character or mapped sequence.
+
+        Sequences matched with modifiers stepped over (a skin-toned variant
+        of a key) are found too; the engine itself is never changed.
+        """
+        if len(token) == 1:
+            return self.table[ord(token)]
+        replacement = self.sequences.get(token)
+        if replacement is None:
+            _, tokens, _, replacements = self._translate_sequences(token)
+            if list(tokens) != [token]:
+                raise KeyError(token)
+            replacement = replacements[token]
+        return replacement
+
+    def _translate_sequences(self, run: str) -> Tuple[str, Counter, Dict[str, int], Dict[str, str]]:
+        """Translate a run containing sequence candidates in one left-to-right pass.
+
+        Returns the ASCII text, the counts of the characters and sequences
+        replaced (in order of first occurrence), their first offsets in the
+        run, and the replacement of each sequence matched, which may be a
+        variant of a key such as a skin-toned one.
+        """
+        table = self.table
+        trie = self._trie
+        pieces = []
+        tokens = Counter()
+        offsets = {}
+        replacements = {}
+        length = len(run)
+        plain = i = 0
+        while i < length:
+            node = trie.get(run[i])
+            if node is None:
+                i += 1
+                continue
+            # Walk as deep as the run allows, remembering the longest match;
+            # modifiers the key does not spell out are stepped over
+            match_end = None
+            j = i + 1
+            while True:
+                if None in node:
+                    match_end, replacement = j, node[None]
+                if j == length:
+                    break
+                char = run[j]
+                j += 1
+                if char in node:
+                    node = node[char]
+                elif char not in SEQUENCE_MODIFIERS:
+                    break
+            if match_end is None:
+                i += 1
+                continue
+            if plain < i:
+                pieces.append(run[plain:i].translate(table))
+                tokens.update(run[plain:i])
+                for offset in range(plain, i):
+                    offsets.setdefault(run[offset], offset)
+            pieces.append(replacement)
+            token = run[i:match_end]
+            replacements[token] = replacement
+            tokens[token] += 1
+            offsets.setdefault(token, i)
+            i = plain = match_end
+        if plain < length:
+            pieces.append(run[plain:].translate(table))
+            tokens.update(run[plain:])
+            for offset in range(plain, length):
+                offsets.setdefault(run[offset], offset)
+        return ''.join(pieces), tokens, offsets, replacements
+
+    @staticmethod
+    def _first_offset(text: str, token: str, sequence_runs: Dict[str, Dict[str, int]]) -> int:
+        """Offset of the first occurrence of token as tokenized, not merely as a substring.
+
+        A character can occur first inside a matched sequence (the U+26A0 of
+        U+26A0 U+FE0F), so runs are checked in order from the first candidate.
+        """
+        offset = text.find(token)
+        run_start = offset
+        while run_start > 0 and not text[run_start - 1].isascii():
+            run_start -= 1
+        for match in NON_ASCII_SPLIT_RE.finditer(text, run_start):
+            run = match.group()
+            run_offsets = sequence_runs.get(run)
+            position = run.find(token) if run_offsets is None else run_offsets.get(token, -1)
+            if position >= 0:
+                return match.start() + position
+        return offset
+
+    def transform(self, text: str) -> Tuple[str, Dict[str, int], Dict[str, int], Dict[str, str]]:
+        """Replace non-ASCII characters in one pass.
+
+        Returns the ASCII text, counts per character or mapped sequence, the
+        offset of each one's first occurrence and its replacement, keyed in
+        order of first occurrence.
+        """
+        # Splitting on the captured runs yields ASCII spans and runs alternately
+        parts = NON_ASCII_SPLIT_RE.split(text)
+        if len(parts) == 1:
+            return text, {}, {}, {}
+        runs = parts[1::2]
+        run_counts = Counter(runs)
+        table = self.table
+        sequence_start = self._sequence_start_re
+        
+        # Work per distinct run, not per occurrence
+        translated = {}
+        counts = Counter()
+        sequence_runs = {}
+        sequence_replacements = {}
+        for run, occurrences in run_counts.items():
+            if len(run) == 1:
+                translated[run] = run.translate(table)
+                counts[run] += occurrences
+                continue
+            if sequence_start is not None and sequence_start.search(run):
+                translated[run], tokens, sequence_runs[run], found = self._translate_sequences(run)
+                sequence_replacements.update(found)
+            else:
+                translated[run] = run.translate(table)
+                tokens = Counter(run)
+            for token, count in tokens.items():
+                counts[token] += count * occurrences
+        parts[1::2] = [translated[run] for run in runs]
+        if sequence_runs:
+            first_offsets = {token: self._first_offset(text, token, sequence_runs) for token in counts}
+        else:
+            first_offsets = {token: text.find(token) for token in counts}
+        return ''.join(parts), dict(counts), first_offsets, self._replacements(counts, sequence_replacements)
+
+    def _replacements(self, counts: Dict[str, int], sequence_replacements: Dict[str, str]) -> Dict[str, str]:
+        """The replacement of each counted token, in the same order"""
+        table = self.table
+        return {
+            token: table[ord(token)] if len(token) == 1 else sequence_replacements[token]
+            for token in counts
+        }
+
+    def transform_bytes(self, data: bytes) -> Optional[Tuple[bytes, Dict[str, int], Dict[str, int], Dict[str, str]]]:
+        """transform() for UTF-8 content, without decoding the document.
+
+        data is decoded as ASCII, so the codec copies ASCII spans in C and
+        stops only at high-bit bytes. The error handler takes the whole run
+        from there and returns its replacement. Each distinct run is decoded
+        and translated once; a single mapped character is a lookup in a
+        bytes-to-bytes table. Offsets are byte offsets, found from where each
+        run first starts. Returns None if data is not valid UTF-8.
+        """
+        byte_table = self._byte_table or self._build_byte_table()
+        table = self.table
+        sequence_start = self._sequence_start_re
+        runs = []
+        translated = {}
+        # Per distinct run: where it first starts, its token counts and the
+        # byte offset of each token within it
+        run_starts = {}
+        run_tokens = {}
+        run_offsets = {}
+        sequence_replacements = {}
+        
+        def replace_run(error: UnicodeDecodeError) -> Tuple[str, int]:
+            data, start = error.object, error.start
+            end = HIGH_BIT_RUN_RE.match(data, start).end()
+            run = data[start:end]
+            runs.append(run)
+            replacement = translated.get(run)
+            if replacement is not None:
+                return replacement, end
+            run_starts[run] = start
+            mapped = byte_table.get(run)
+            if mapped is not None:
+                run_tokens[run] = {mapped[0]: 1}
+                run_offsets[run] = {mapped[0]: 0}
+                replacement = mapped[1]
+            else:
+                # Raises UnicodeDecodeError, ending the decode, if data is not UTF-8
+                text = run.decode('utf-8')
+                if sequence_start is not None and sequence_start.search(text):
+                    replacement, run_tokens[run], offsets, found = self._translate_sequences(text)
+                    sequence_replacements.update(found)
+                else:
+                    replacement = text.translate(table)
+                    run_tokens[run] = Counter(text)
+                    offsets = {}
+                    for offset, char in enumerate(text):
+                        offsets.setdefault(char, offset)
+                run_offsets[run] = {token: len(text[:offset].encode('utf-8')) for token, offset in offsets.items()}
+            translated[run] = replacement
+            return replacement, end
+        
+        _run_handler.handler = replace_run
+        try:
+            new_data = data.decode('ascii', errors=_RUN_ERRORS).encode('ascii')
+        except UnicodeDecodeError:
+            return None
+        finally:
+            _run_handler.handler = None
+        
+        # Work per distinct run, not per occurrence
+        counts = Counter()
+        first_offsets = {}
+        for run, occurrences in Counter(runs).items():
+            for token, count in run_tokens[run].items():
+                counts[token] += count * occurrences
+            # A token can first occur inside a later run, e.g. alone after a sequence
+            start = run_starts[run]
+            for token, offset in run_offsets[run].items():
+                if token not in first_offsets or start + offset < first_offsets[token]:
+                    first_offsets[token] = start + offset
+        return (new_data, dict(counts), {token: first_offsets[token] for token in counts},
+                self._replacements(counts, sequence_replacements))
+
+    def replace(self, text: str) -> Tuple[str, Dict[str, int]]:
+        """Replace non-ASCII characters, returning the new text and per-character counts"""
+        new_text, counts, _, _ = self.transform(text)
+        return new_text, counts
+
+def _join_surrogates(text: str) -> str:
+    """Combine any UTF-16 surrogate pairs left in a string into real code points"""
+    return text.encode('utf-16-le', 'surrogatepass').decode('utf-16-le', 'replace')
+
+def load_mapping(data: bytes) -> Dict[str, str]:
+    """Flatten a UnicodeReplacements.json document into one character mapping.
+
+    Categories under "replacements" are merged in file order. A flat
+    {"char": "replacement"} object is accepted as well. Raises ValueError if
+    the document does not have that shape.
+    """
+    document = json.loads(data.decode('utf-8-sig'))
+    if not isinstance(document, dict):
+        raise ValueError(f"Expected a JSON object, not {type(document).__name__}")
+    sections = document.get('replacements', document)
+    if not isinstance(sections, dict):
+        raise ValueError(f'"replacements" must be an object, not {type(sections).__name__}')
+    nested = [isinstance(section, dict) for section in sections.values()]
+    if nested and all(nested):
+        sections = list(sections.values())
+    elif any(nested):
+        raise ValueError('"replacements" mixes categories with single mappings')
+    else:
+        sections = [sections]
+    mapping = {}
+    for section in sections:
+        for char, replacement in section.items():
+            if not isinstance(replacement, str):
+                raise ValueError(f"Replacement for {char!r} is not a string: {replacement!r}")
+            mapping[_join_surrogates(char)] = replacement
+    return mapping
+
+def _mapping_key(data: bytes) -> str:
+    """Cache key covering the JSON content, the built-in table and the marshal format"""
+    hasher = hashlib.blake2b(data, digest_size=16)
+    # The built-in table lives in this file; its size and mtime stand in for
+    # hashing REPLACEMENTS, which would cost more than loading the cache
+    source = os.stat(__file__)
+    hasher.update(f'{source.st_size}:{source.st_mtime_ns}:{MAPPING_CACHE_VERSION}:{sys.version_info[:2]}'.encode('ascii'))
+    return hasher.hexdigest()
+
+# Read once: os.umask() can only be queried by changing it, which is not thread-safe
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def temp_file_for(target: Path) -> Tuple[int, str]:
+    """Create a temp file next to target, to be renamed over it, with target's mode and owner.
+
+    mkstemp creates files as 0600 owned by the current user; the temp file
+    gets target's mode bits, owner and group instead (as far as permitted),
+    or the mode a plain open() would give a new target.
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{target.name}.', suffix='.tmp', dir=target.parent)
+    try:
+        try:
+            st = os.stat(target)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o666 & ~_UMASK)
+            return fd, tmp_path
+        os.chmod(tmp_path, stat.S_IMODE(st.st_mode))
+        if hasattr(os, 'chown'):
+            try:
+                os.chown(tmp_path, st.st_uid, st.st_gid)
+            except PermissionError:
+                # Only root can give a file away; the group may still be one of ours
+                try:
+                    os.chown(tmp_path, -1, st.st_gid)
+                except PermissionError:
+                    pass
+    except BaseException:
+        os.close(fd)
+        os.unlink(tmp_path)
+        raise
+    return fd, tmp_path
+
+def load_engine(mapping_path: Optional[Path] = MAPPING_PATH, use_cache: bool = True) -> ReplacementEngine:
+    """Build the engine from REPLACEMENTS overlaid with the mapping file.
+
+    The compiled table is marshalled to <mapping>.cache together with a hash
+    of its inputs, so repeat runs load it without parsing the JSON or
+    validating the table again. A missing default mapping file means
+    built-ins only, while any other missing file raises FileNotFoundError;
+    a cache that is stale, corrupt or unwritable is simply rebuilt.
+    """
+    try:
+        data = mapping_path.read_bytes() if mapping_path else None
+    except FileNotFoundError:
+        # Only the default mapping is optional; a path that was asked for must exist
+        if mapping_path != MAPPING_PATH:
+            raise
+        data = None
+    if data is None:
+        return ReplacementEngine(REPLACEMENTS)
+    
+    key = _mapping_key(data)
+    cache_path = mapping_path.with_name(mapping_path.name + MAPPING_CACHE_SUFFIX)
+    if use_cache:
+        try:
+            # One read: marshal.load() on a file object reads it piecemeal
+            cached_key, table, sequences, fingerprint = marshal.loads(cache_path.read_bytes())
+            if cached_key == key:
+                return ReplacementEngine.from_table(table, sequences, fingerprint)
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+    
+    engine = ReplacementEngine({**REPLACEMENTS, **load_mapping(data)})
+    if use_cache:
+        try:
+            fd, tmp_path = temp_file_for(cache_path)
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump((key, dict(engine.table), engine.sequences, engine.fingerprint), f)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # A read-only checkout just compiles on every run
+            pass
+    return engine
+
+try:
+    ENGINE = load_engine()
+except (OSError, ValueError) as e:
+    print(f"Warning: ignoring {MAPPING_PATH}: {e}")
+    ENGINE = ReplacementEngine(REPLACEMENTS)
 
 def replace_unicode(text: str) -> Tuple[str, List[Tuple[str, str]]]:
     """Replace Unicode characters with ASCII equivalents"""
-    result = []
-    replacements_made = []
-    replacement_counts = {}
-    
-    for char in text:
-        if ord(char) > 127:
-            replacement = REPLACEMENTS.get(char, f'[U+{ord(char):04X}]')
-            result.append(replacement)
-            
-            # Track replacements
-            if char not in replacement_counts:
-                replacement_counts[char] = 0
-            replacement_counts[char] += 1
-            
-            # Only record unique replacements
-            if (char, replacement) not in replacements_made:
-                replacements_made.append((char, replacement))
-        else:
-            result.append(char)
+    new_text, _, _, replacements = ENGINE.transform(text)
+    # Keyed in order of first occurrence
+    return new_text, list(replacements.items())
+
+def verify_ascii(text: Union[str, bytes]) -> bool:
+    """Verify text contains only ASCII characters (constant time for str: CPython records this per string)"""
+    return text.isascii()
+
+def _offsets_to_lines(text: Union[str, bytes], offsets: Dict[str, int], base_line: int = 1) -> Dict[str, int]:
+    """Convert character (or, for bytes, byte) offsets into 1-based line numbers with one forward sweep"""
+    newline = b'\n' if isinstance(text, bytes) else '\n'
+    lines = {}
+    line = base_line
+    position = 0
+    for char, offset in sorted(offsets.items(), key=lambda item: item[1]):
+        line += text.count(newline, position, offset)
+        position = offset
+        lines[char] = line
+    return {char: lines[char] for char in offsets}
+
+class PhaseTimer:
+    """Wall and CPU time spent in each processing phase, for --profile.
+
+    A timer is active for one file at a time (see _process_timed). Its
+    totals and trace events travel back to the parent with the result.
+    """
+
+    __slots__ = ('phases', 'events', 'pid')
+
+    def __init__(self):
+        self.phases = {}
+        self.events = []
+        self.pid = os.getpid()
+
+    def phase(self, name: str) -> '_Phase':
+        return _Phase(self, name)
+
+class _Phase:
+    """Context manager adding one interval to a PhaseTimer"""
+
+    __slots__ = ('timer', 'name', 'wall', 'cpu')
+
+    def __init__(self, timer: PhaseTimer, name: str):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        totals = self.timer.phases.setdefault(self.name, [0.0, 0.0])
+        totals[0] += wall
+        totals[1] += cpu
+        self.timer.events.append((self.name, self.wall, wall))
+
+_ACTIVE_TIMER: Optional[PhaseTimer] = None
+_NO_PHASE = contextlib.nullcontext()
+
+def _phase(name: str):
+    """Time a phase of the current file when profiling; a shared no-op otherwise"""
+    timer = _ACTIVE_TIMER
+    return _NO_PHASE if timer is None else _Phase(timer, name)
+
+def content_hash(data: bytes) -> str:
+    """Fast content fingerprint used by the scan cache"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def _file_state(filepath: Path, data_hash: Optional[str], unicode_count: int) -> Dict:
+    """Snapshot of a file as left on disk, as recorded in the scan cache"""
+    st = os.stat(filepath)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': data_hash, 'unicode_count': unicode_count}
+
+class ScanCache:
+    """On-disk index of file size, mtime, content hash and last scan result.
+
+    Entries are keyed by path relative to the cache root. The whole index is
+    discarded when the replacement mapping changes, since every recorded
+    result depends on it. Paths looked up during a run are remembered, so a
+    run that walked the whole tree can drop the entries of files that are
+    gone (see save).
+    """
+
+    def __init__(self, cache_path: Path, root: Path, fingerprint: str):
+        self.cache_path = cache_path
+        self.root = root
+        self.fingerprint = fingerprint
+        self.entries = {}
+        self.seen = set()
+        # When the index was written, by the filesystem's clock
+        self.written_ns = 0
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+                self.written_ns = os.fstat(f.fileno()).st_mtime_ns
+            if stored.get('version') == CACHE_VERSION and stored.get('mapping') == fingerprint:
+                self.entries = stored['files']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    def _key(self, filepath: Path) -> str:
+        return Path(os.path.relpath(filepath, self.root)).as_posix()
+
+    def lookup(self, filepath: Path) -> Optional[Dict]:
+        """Return the cached entry if the file is unchanged.
+
+        Matching size and mtime are trusted unless the mtime is within
+        CACHE_RACY_NS of the index write (git's "racily clean" case). Then,
+        or when only the mtime differs (a checkout touching the file), the
+        content is re-hashed and the entry kept if the hash matches.
+        """
+        key = self._key(filepath)
+        self.seen.add(key)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return None
+        if entry['size'] != st.st_size:
+            return None
+        if entry['mtime_ns'] == st.st_mtime_ns and entry['mtime_ns'] < self.written_ns - CACHE_RACY_NS:
+            return entry
+        # Large files are not hashed
+        if entry['hash'] is None:
+            return None
+        try:
+            with _phase('hash'), open(filepath, 'rb') as f:
+                data_hash = content_hash(f.read())
+        except OSError:
+            return None
+        if data_hash != entry['hash']:
+            return None
+        entry['mtime_ns'] = st.st_mtime_ns
+        return entry
+
+    def update(self, filepath: Path, result: Optional[Dict]):
+        """Record a process_file result; results without a 'state' snapshot evict the entry"""
+        key = self._key(filepath)
+        if not result or result.get('state') is None:
+            self.entries.pop(key, None)
+            return
+        self.entries[key] = result['state']
+
+    def save(self, prune: bool = False):
+        """Write the index atomically next to the tree it describes.
+
+        With prune, entries for paths not looked up during this run (files
+        deleted, renamed or no longer selected) are dropped, so the index
+        does not grow without bound.
+        """
+        if prune:
+            self.entries = {key: entry for key, entry in self.entries.items() if key in self.seen}
+        fd, tmp_path = temp_file_for(self.cache_path)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': CACHE_VERSION, 'mapping': self.fingerprint, 'files': self.entries},
+                          f, separators=(',', ':'))
+            os.replace(tmp_path, self.cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+def create_backup_copy(filepath: Path) -> Path:
+    """Copy a file to a timestamped .backup_ sibling"""
+    backup_path = filepath.with_suffix(filepath.suffix + f'.backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}')
+    shutil.copy2(filepath, backup_path)
+    print(f"Backup created: {backup_path}")
+    return backup_path
+
+def _clone_file(source: Path, target: Path):
+    """Create target with source's content: hardlink, then reflink, then a plain copy"""
+    try:
+        # Safe because the original is always replaced by rename, never rewritten in place
+        os.link(source, target)
+        return
+    except FileExistsError:
+        raise
+    except OSError:
+        pass
+    try:
+        import fcntl
+        with open(source, 'rb') as src, open(target, 'xb') as dst:
+            fcntl.ioctl(dst.fileno(), 0x40049409, src.fileno())  # FICLONE
+        return
+    except FileExistsError:
+        raise
+    except (ImportError, OSError):
+        try:
+            os.unlink(target)
+        except OSError:
+            pass
+    shutil.copy2(source, target)
+
+def store_backup(filepath: Path, store_dir: Path, data_hash: str) -> Path:
+    """Save a file's current content in a content-addressed backup store.
+
+    Objects live at objects/<hash[:2]>/<hash>, so identical files share one
+    copy. Every backup is logged to index.ndjson with the original path.
+    """
+    obj_path = store_dir / 'objects' / data_hash[:2] / data_hash
+    if obj_path.exists():
+        print(f"Backup exists: {obj_path}")
+    else:
+        obj_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            _clone_file(filepath, obj_path)
+            print(f"Backup created: {obj_path}")
+        except FileExistsError:
+            # Another worker stored identical content first
+            print(f"Backup exists: {obj_path}")
     
-    return ''.join(result), replacements_made
+    record = json.dumps({
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'path': str(Path(filepath).resolve()),
+        'hash': data_hash
+    }) + '\n'
+    # A single O_APPEND write keeps lines intact when workers log concurrently
+    fd = os.open(store_dir / 'index.ndjson', os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, record.encode('utf-8'))
+    finally:
+        os.close(fd)
+    return obj_path
 
-def verify_ascii(text: str) -> bool:
-    """Verify text contains only ASCII characters"""
-    for char in text:
-        if ord(char) > 127:
-            return False
-    return True
+def _backup(filepath: Path, backup_dir: Optional[str], data_hash: str):
+    """Back up a file before it is replaced, to the store or as a .backup_ sibling"""
+    if backup_dir is None:
+        create_backup_copy(filepath)
+    else:
+        store_backup(filepath, Path(backup_dir), data_hash)
+
+def write_target(filepath: Path) -> Path:
+    """The file a write to filepath must replace: through symlinks, so links stay links"""
+    return Path(os.path.realpath(filepath))
 
-def process_file(filepath: Path, preview_only: bool = False, create_backup: bool = True) -> Optional[Dict]:
-    """Process a single file"""
+def atomic_write(filepath: Path, data: bytes):
+    """Replace filepath with data via a fsynced temp file, so a crash never leaves it truncated"""
+    target = write_target(filepath)
+    fd, tmp_path = temp_file_for(target)
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-    except UnicodeDecodeError:
-        print(f"Warning: {filepath} - Unicode decode error, trying with errors='replace'")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, target)
+    except BaseException:
         try:
-            with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
-                content = f.read()
-        except Exception as e:
-            print(f"Error reading {filepath}: {e}")
-            return None
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _stream_replace(src, dst, start: int, encoding: str, hasher=None, base_line: int = 1,
+                    engine: Optional[ReplacementEngine] = None) -> Tuple[Counter, Dict[str, int], int, Dict[str, str]]:
+    """Decode src from offset start in chunks, writing replaced ASCII to dst if given.
+
+    Returns the per-character counts, the line of each character's first
+    occurrence (counting from base_line at offset start), the number of
+    bytes the replaced text takes and each character's replacement.
+    """
+    engine = engine or ENGINE
+    src.seek(start)
+    carry = ''
+    if encoding == FALLBACK_ENCODING:
+        decoder = codecs.getincrementaldecoder(encoding)('unicode_replacer.latin1')
+        if start == 0:
+            # A UTF-8 BOM stays U+FEFF ahead of the legacy text, as in decode_bytes
+            head = src.read(len(codecs.BOM_UTF8))
+            if head == codecs.BOM_UTF8:
+                carry = '\ufeff'
+                if hasher is not None:
+                    hasher.update(head)
+            else:
+                src.seek(start)
+    else:
+        # Strict for UTF-8, marked or not, so a failure can fall back to cp1252
+        decoder = codecs.getincrementaldecoder(encoding)('strict' if encoding == 'utf-8' else 'replace')
+    counts = Counter()
+    first_lines = {}
+    replacements = {}
+    line = base_line
+    written = 0
+    while True:
+        block = src.read(STREAM_CHUNK_SIZE)
+        if hasher is not None:
+            hasher.update(block)
+        # The incremental decoder holds back bytes split across blocks
+        text = carry + decoder.decode(block, final=not block)
+        carry = ''
+        if block and text and not text[-1].isascii():
+            # Likewise hold back a trailing non-ASCII run, which may be the
+            # start of a sequence that continues in the next block
+            cut = len(text) - 1
+            while cut > 0 and not text[cut - 1].isascii() and len(text) - cut < SEQUENCE_CARRY_LIMIT:
+                cut -= 1
+            if cut == 0 or text[cut - 1].isascii():
+                text, carry = text[:cut], text[cut:]
+        if text:
+            new_text, chunk_counts, first_offsets, chunk_replacements = engine.transform(text)
+            counts.update(chunk_counts)
+            replacements.update(chunk_replacements)
+            unseen = {char: offset for char, offset in first_offsets.items() if char not in first_lines}
+            if unseen:
+                first_lines.update(_offsets_to_lines(text, unseen, line))
+            line += text.count('\n')
+            written += len(new_text)
+            if dst is not None:
+                dst.write(new_text.encode('ascii'))
+        if not block:
+            return counts, first_lines, written, replacements
+
+def process_large_file(filepath: Path, preview_only: bool = False, create_backup: bool = True,
+                       track_state: bool = False, backup_dir: Optional[str] = None,
+                       engine: Optional[ReplacementEngine] = None) -> Optional[Dict]:
+    """Process a file in fixed-size chunks, keeping memory use flat.
+
+    The file is first scanned block by block for a high-bit byte. Only then
+    is it decoded incrementally and written to a temporary file, which is
+    fsynced and renamed over the original once complete.
+    """
+    try:
+        src = open(filepath, 'rb')
+    except Exception as e:
+        print(f"Error reading {filepath}: {e}")
+        return None
+    
+    with src:
+        # A BOM marks the encoding up front; its bytes are never ASCII, so a
+        # marked file is always decoded from offset 0
+        encoding = sniff_encoding(src.read(4)) or 'utf-8'
+        src.seek(0)
+        # Skip the leading pure-ASCII blocks; they end on a character boundary
+        start = 0
+        start_line = 1
+        with _phase('scan'):
+            while True:
+                block = src.read(STREAM_CHUNK_SIZE)
+                if not block or not block.isascii():
+                    break
+                start += len(block)
+                start_line += block.count(b'\n')
+        if not block:
+            result = {
+                'file': filepath,
+                'unicode_count': 0,
+                'replacements': [],
+                'replacement_counts': {},
+                'bytes_in': start,
+                'bytes_out': start,
+                'status': 'no_unicode'
+            }
+            if track_state:
+                # Large files are not hashed; size and mtime identify them
+                result['state'] = _file_state(filepath, None, 0)
+            return result
+        
+        tmp_path = None
+        prefix_hasher = hasher = None
+        with _phase('stream'):
+            try:
+                if preview_only:
+                    dst = None
+                else:
+                    target = write_target(filepath)
+                    fd, tmp_path = temp_file_for(target)
+                    dst = os.fdopen(fd, 'wb')
+                    # The original is hashed as it streams past, for the backup store
+                    prefix_hasher = hashlib.blake2b(digest_size=16)
+                try:
+                    if dst is not None:
+                        # The ASCII prefix is copied through unchanged
+                        src.seek(0)
+                        remaining = start
+                        while remaining:
+                            block = src.read(min(STREAM_CHUNK_SIZE, remaining))
+                            prefix_hasher.update(block)
+                            dst.write(block)
+                            remaining -= len(block)
+                        hasher = prefix_hasher.copy()
+                    try:
+                        counts, first_lines, written, replacements = _stream_replace(
+                            src, dst, start, encoding, hasher, start_line, engine)
+                    except UnicodeDecodeError:
+                        print(f"Warning: {filepath} - not valid UTF-8, decoding as {FALLBACK_ENCODING}")
+                        encoding = FALLBACK_ENCODING
+                        if dst is not None:
+                            dst.seek(start)
+                            dst.truncate()
+                            hasher = prefix_hasher.copy()
+                        counts, first_lines, written, replacements = _stream_replace(
+                            src, dst, start, encoding, hasher, start_line, engine)
+                    bytes_in = src.tell()
+                    if dst is not None:
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                finally:
+                    if dst is not None:
+                        dst.close()
+            except UnicodeEncodeError as e:
+                print(f"ERROR: {filepath} - Result still contains Unicode characters! ({e})")
+                if tmp_path:
+                    os.unlink(tmp_path)
+                status, counts, first_lines, replacements = 'error', Counter(), {}, {}
+                bytes_in, written = src.tell(), 0
+            except BaseException:
+                if tmp_path:
+                    os.unlink(tmp_path)
+                raise
+            else:
+                status = 'success'
+    
+    if tmp_path and status == 'success':
+        try:
+            if create_backup:
+                with _phase('backup'):
+                    _backup(filepath, backup_dir, hasher.hexdigest())
+            with _phase('write'):
+                os.replace(tmp_path, target)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        print(f"Updated: {filepath}")
+    
+    counts = dict(counts)
+    result = {
+        'file': filepath,
+        'unicode_count': sum(len(token) * count for token, count in counts.items()),
+        'replacements': list(replacements.items()),
+        'replacement_counts': counts,
+        'first_lines': first_lines,
+        'encoding': encoding,
+        'bytes_in': bytes_in,
+        'bytes_out': start + written,
+        'status': status
+    }
+    if track_state and status == 'success':
+        result['state'] = _file_state(filepath, None, result['unicode_count'] if preview_only else 0)
+    return result
+
+def check_file(filepath: Path, data: Optional[bytes] = None, block_size: int = CHECK_BLOCK_SIZE) -> Optional[Dict]:
+    """Report whether a file contains any non-ASCII byte, reading only up to the first one.
+
+    Nothing is decoded, replaced or written. An offending file's result has
+    status 'unicode_found' and the 1-based (line, column) of that byte in
+    'first_non_ascii'. When data is given it is checked instead of the file.
+    """
+    try:
+        with _phase('check'), (io.BytesIO(data) if data is not None else open(filepath, 'rb')) as f:
+            offset = 0
+            line = 1
+            line_start = 0
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                if not block.isascii():
+                    position = HIGH_BIT_RUN_RE.search(block).start()
+                    line += block.count(b'\n', 0, position)
+                    newline = block.rfind(b'\n', 0, position)
+                    if newline >= 0:
+                        line_start = offset + newline + 1
+                    offset += position
+                    return {
+                        'file': filepath,
+                        'unicode_count': 0,
+                        'replacements': [],
+                        'replacement_counts': {},
+                        'first_non_ascii': (line, offset - line_start + 1),
+                        # Only what was read to find it
+                        'bytes_in': offset + 1,
+                        'status': 'unicode_found'
+                    }
+                line += block.count(b'\n')
+                newline = block.rfind(b'\n')
+                if newline >= 0:
+                    line_start = offset + newline + 1
+                offset += len(block)
     except Exception as e:
         print(f"Error reading {filepath}: {e}")
         return None
+    return {
+        'file': filepath,
+        'unicode_count': 0,
+        'replacements': [],
+        'replacement_counts': {},
+        'bytes_in': offset,
+        'status': 'no_unicode'
+    }
+
+def _read_file(filepath: Path, stream_threshold: int = STREAM_THRESHOLD, opener=open) -> Optional[bytes]:
+    """Read a whole file with opener, or return None if it is large enough to stream"""
+    if os.path.getsize(filepath) >= stream_threshold:
+        return None
+    with _phase('read'), opener(filepath, 'rb') as f:
+        return f.read()
+
+def _patch_line(line: bytes) -> bytes:
+    if line.endswith(b'\n'):
+        return line
+    return line + b'\n\\ No newline at end of file\n'
+
+def unified_diff(data: bytes, new_data: bytes, context: int = DIFF_CONTEXT) -> Optional[bytes]:
+    """The unified diff hunks that turn data into new_data, or None if lines do not match up.
+
+    Replacements are ASCII without newlines, so a line changes exactly when
+    it holds non-ASCII bytes, and keeps its number: the hunks are built from
+    the lines of the non-ASCII runs without comparing the two texts. Only
+    valid for encodings where '\\n' is the byte 0x0A (UTF-8, cp1252).
+    """
+    if data.count(b'\n') != new_data.count(b'\n'):
+        return None
+    old_index, new_index = LineIndex(data), LineIndex(new_data)
+    changed = []
+    for match in HIGH_BIT_RUN_RE.finditer(data):
+        line = old_index.line(match.start())
+        if not changed or changed[-1] != line:
+            changed.append(line)
     
-    # Find Unicode characters
-    unicode_chars = find_unicode_chars(content)
-    if not unicode_chars:
+    hunks = []
+    i = 0
+    while i < len(changed):
+        # Changes whose context would touch or overlap share a hunk
+        j = i
+        while j + 1 < len(changed) and changed[j + 1] - changed[j] <= 2 * context + 1:
+            j += 1
+        group = set(changed[i:j + 1])
+        first = max(1, changed[i] - context)
+        old_lines = old_index.lines(first, changed[j] + context)
+        body = []
+        new_count = 0
+        k = 0
+        while k < len(old_lines):
+            if first + k not in group:
+                body.append(b' ' + _patch_line(old_lines[k]))
+                new_count += 1
+                k += 1
+                continue
+            # A block of changed lines: all removals, then all additions
+            end = k
+            while end < len(old_lines) and first + end in group:
+                end += 1
+            # A last line without a newline that is replaced by nothing is gone
+            new_lines = new_index.lines(first + k, first + end - 1)
+            body.extend(b'-' + _patch_line(line) for line in old_lines[k:end])
+            body.extend(b'+' + _patch_line(line) for line in new_lines)
+            new_count += len(new_lines)
+            k = end
+        hunks.append(b'@@ -%d,%d +%d,%d @@\n' % (first, len(old_lines), first if new_count else first - 1, new_count))
+        hunks.extend(body)
+        i = j + 1
+    return b''.join(hunks)
+
+def _diff_name(name: str) -> bytes:
+    """A path as git writes it in diff headers, C-quoted if it has special characters"""
+    raw = os.fsencode(name)
+    if not re.search(rb'[\x00-\x1f"\\\x7f-\xff]', raw):
+        return raw
+    escapes = {ord('"'): b'\\"', ord('\\'): b'\\\\', ord('\t'): b'\\t', ord('\n'): b'\\n'}
+    return b'"' + b''.join(
+        escapes.get(byte) or (b'\\%03o' % byte if byte < 32 or byte >= 127 else bytes([byte])) for byte in raw
+    ) + b'"'
+
+def diff_header(filepath: Path) -> bytes:
+    """git-style file header for a diff of filepath, relative to the current directory"""
+    try:
+        name = Path(os.path.relpath(filepath)).as_posix()
+    except ValueError:
+        # Another drive on Windows
+        name = filepath.as_posix()
+    old, new = _diff_name('a/' + name), _diff_name('b/' + name)
+    return b'diff --git %s %s\n--- %s\n+++ %s\n' % (old, new, old, new)
+
+def _scan_data(filepath: Path, data: bytes, report_locations: int = 0,
+               engine: Optional[ReplacementEngine] = None,
+               sample_unmapped: bool = False, diff: bool = False) -> Tuple[Dict, Optional[bytes]]:
+    """Replace and verify the content of filepath, without touching the disk.
+
+    Returns the result and the ASCII replacement content, or None for the
+    content when there is nothing to write. UTF-8 with little non-ASCII
+    content (the common case) is handled as bytes throughout; denser UTF-8
+    and other encodings are decoded to str. With
+    sample_unmapped, 'unmapped_samples' holds the line where each character
+    without a mapping first occurs. With diff, 'diff' holds the changes as
+    unified diff hunks (see unified_diff), or None if they cannot be shown
+    line by line.
+    """
+    # Pure-ASCII files (the common case) need no decoding or scanning
+    if data.isascii():
         return {
             'file': filepath,
             'unicode_count': 0,
             'replacements': [],
+            'replacement_counts': {},
+            'bytes_in': len(data),
+            'bytes_out': len(data),
             'status': 'no_unicode'
-        }
+        }, None
     
-    # Replace Unicode
-    new_content, replacements = replace_unicode(content)
+    # One fused pass replaces, counts and finds first occurrences; the
+    # counts double as the detection result
+    engine = engine or ENGINE
+    encoding = sniff_encoding(data)
+    transformed = None
+    if encoding in (None, 'utf-8') and non_ascii_density(data) <= BYTES_PATH_MAX_DENSITY:
+        with _phase('transform'):
+            transformed = engine.transform_bytes(data)
+    if transformed is not None:
+        content, encoding = data, 'utf-8'
+        new_content, replacement_counts, first_offsets, token_replacements = transformed
+    else:
+        with _phase('decode'):
+            content, encoding = decode_bytes(data)
+        if encoding == FALLBACK_ENCODING:
+            print(f"Warning: {filepath} - not valid UTF-8, decoded as {FALLBACK_ENCODING}")
+        with _phase('transform'):
+            new_content, replacement_counts, first_offsets, token_replacements = engine.transform(content)
+    with _phase('transform'):
+        replacements = list(token_replacements.items())
+        first_lines = _offsets_to_lines(content, first_offsets)
+    result = {
+        'file': filepath,
+        # Code points, not replacements: a sequence counts once per character
+        'unicode_count': sum(len(token) * count for token, count in replacement_counts.items()),
+        'replacements': replacements,
+        'replacement_counts': replacement_counts,
+        'first_lines': first_lines,
+        'encoding': encoding,
+        'bytes_in': len(data),
+        # ASCII by construction: one byte per character
+        'bytes_out': len(new_content),
+        'status': 'success'
+    }
+    if sample_unmapped:
+        with _phase('locate'):
+            result['unmapped_samples'] = {
+                token: _context_at(content, first_offsets[token])
+                for token, replacement in replacements if is_fallback(token, replacement)
+            }
+    if report_locations:
+        with _phase('locate'):
+            text = content.decode('utf-8') if isinstance(content, bytes) else content
+            result['locations'] = [
+                (hit.line, hit.column, hit.code, hit.context)
+                for hit in islice(iter_unicode_chars(text), report_locations)
+            ]
     
-    # Verify result is ASCII-only
-    if not verify_ascii(new_content):
+    # Verify result is ASCII-only (guaranteed by the engine; this is a flag check)
+    with _phase('verify'):
+        is_ascii = verify_ascii(new_content)
+    if not is_ascii:
         print(f"ERROR: {filepath} - Result still contains Unicode characters!")
-        return {
-            'file': filepath,
-            'unicode_count': len(unicode_chars),
-            'replacements': replacements,
-            'status': 'error'
-        }
-    
-    if not preview_only:
+        result['status'] = 'error'
+        return result, None
+    if isinstance(new_content, str):
+        new_content = new_content.encode('ascii')
+    if diff:
+        with _phase('diff'):
+            result['diff'] = None if encoding.startswith('utf-16') else unified_diff(data, new_content)
+        if result['diff'] is None:
+            print(f"Warning: {filepath} - {encoding} content cannot be diffed line by line; not in the diff")
+    return result, new_content
+
+def _commit_result(filepath: Path, data: bytes, new_data: Optional[bytes], result: Dict,
+                   preview_only: bool = False, create_backup: bool = True, track_state: bool = False,
+                   backup_dir: Optional[str] = None) -> Dict:
+    """Back up and rewrite filepath with new_data, then record its state for the scan cache"""
+    if new_data is not None and not preview_only:
         # Create backup
         if create_backup:
-            backup_path = filepath.with_suffix(filepath.suffix + f'.backup_{datetime.now().strftime("%Y%m%d_%H%M%S")}')
-            shutil.copy2(filepath, backup_path)
-            print(f"Backup created: {backup_path}")
+            with _phase('backup'):
+                _backup(filepath, backup_dir, content_hash(data))
         
-        # Write new content with ASCII encoding
+        # The new content is ASCII; line endings pass through as bytes
+        with _phase('write'):
+            atomic_write(filepath, new_data)
+        data = new_data
+        print(f"Updated: {filepath}")
+    
+    if track_state and result['status'] in ('success', 'no_unicode'):
+        # After a write the file on disk is pure ASCII
+        with _phase('hash'):
+            result['state'] = _file_state(filepath, content_hash(data), result['unicode_count'] if preview_only else 0)
+    return result
+
+def process_file(filepath: Path, preview_only: bool = False, create_backup: bool = True,
+                 stream_threshold: int = STREAM_THRESHOLD, report_locations: int = 0,
+                 track_state: bool = False, backup_dir: Optional[str] = None,
+                 engine: Optional[ReplacementEngine] = None, data: Optional[bytes] = None,
+                 opener=open, check_only: bool = False, sample_unmapped: bool = False,
+                 diff: bool = False) -> Optional[Dict]:
+    """Process a single file
+
+    When report_locations is set, the result also carries up to that many
+    (line, column, code, context) tuples for the first non-ASCII characters.
+    When track_state is set, it carries the size, mtime and content hash of
+    the file as left on disk, for the scan cache. Backups go to the
+    content-addressed store in backup_dir, or to a .backup_ sibling if None.
+    The module's ENGINE is used unless another engine is given. When data
+    is given (such as a staged blob) it is scanned instead of the file on
+    disk, and nothing is written. opener replaces open() for the read.
+    With check_only, the file is only checked for non-ASCII (see check_file).
+    sample_unmapped adds sample lines for unmapped characters, and diff the
+    changes as unified diff hunks (see _scan_data).
+    """
+    if check_only:
+        return check_file(filepath, data)
+    if data is not None:
+        preview_only, track_state = True, False
+    else:
         try:
-            with open(filepath, 'w', encoding='ascii') as f:
-                f.write(new_content)
-            print(f"Updated: {filepath}")
-        except UnicodeEncodeError as e:
-            print(f"ERROR writing {filepath}: {e}")
-            return {
-                'file': filepath,
-                'unicode_count': len(unicode_chars),
-                'replacements': replacements,
-                'status': 'write_error'
+            data = _read_file(filepath, stream_threshold, opener)
+            if data is None:
+                return process_large_file(filepath, preview_only, create_backup, track_state, backup_dir, engine)
+        except Exception as e:
+            print(f"Error reading {filepath}: {e}")
+            return None
+    
+    result, new_data = _scan_data(filepath, data, report_locations, engine, sample_unmapped, diff)
+    return _commit_result(filepath, data, new_data, result, preview_only, create_backup, track_state, backup_dir)
+
+# Never descended into or processed, on top of any --exclude patterns
+DEFAULT_EXCLUDES = ['.git', '.hg', '.svn', 'node_modules', '__pycache__', BACKUP_DIRNAME, CACHE_FILENAME, '*.backup_*']
+
+def _gitignore_regex(pattern: str) -> str:
+    """Translate one .gitignore glob into a regex over '/'-separated relative paths"""
+    i = 0
+    out = []
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+            continue
+        if char == '*':
+            out.append('[^/]*')
+        elif char == '?':
+            out.append('[^/]')
+        elif char == '[':
+            end = pattern.find(']', i + 2)
+            if end < 0:
+                out.append(re.escape(char))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = end
+        elif char == '\\' and i + 1 < len(pattern):
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(char))
+        i += 1
+    return ''.join(out)
+
+class IgnoreRules:
+    """Patterns from one .gitignore file, matched relative to its directory.
+
+    Supports the common subset of gitignore semantics: globs including **,
+    ! negation, trailing / for directories only, and patterns anchored by
+    a leading or embedded /. Later patterns override earlier ones.
+    """
+
+    def __init__(self, lines: Iterable[str]):
+        self.rules = []
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            line = line.rstrip(' ')
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            if not line:
+                continue
+            if '/' in line:
+                regex = _gitignore_regex(line.lstrip('/'))
+            else:
+                regex = '(?:.*/)?' + _gitignore_regex(line)
+            self.rules.append((re.compile(regex + r'\Z', re.DOTALL), negate, dir_only))
+
+    @classmethod
+    def load(cls, directory: Path) -> Optional['IgnoreRules']:
+        try:
+            with open(directory / '.gitignore', 'r', encoding='utf-8', errors='replace') as f:
+                rules = cls(f)
+        except OSError:
+            return None
+        return rules if rules.rules else None
+
+    def match(self, relpath: str, is_dir: bool) -> Optional[bool]:
+        """True if ignored, False if re-included, None if no pattern applies"""
+        verdict = None
+        for regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(relpath):
+                verdict = not negate
+        return verdict
+
+def _matches_any(name: str, relpath: str, patterns: List[str]) -> bool:
+    """Match patterns without a '/' against the name, others against the relative path"""
+    for pattern in patterns:
+        if fnmatch.fnmatch(relpath if '/' in pattern else name, pattern):
+            return True
+    return False
+
+def walk_files(root: Path, include: List[str], exclude: Iterable[str] = (), recursive: bool = True,
+               use_gitignore: bool = True) -> Iterator[Path]:
+    """Lazily yield files under root matching any include pattern.
+
+    Uses os.scandir and prunes excluded and git-ignored directories before
+    descending into them, so results stream out while the walk continues.
+    Directories are visited in sorted order for a deterministic sequence.
+    """
+    exclude = DEFAULT_EXCLUDES + list(exclude)
+    # Each stack entry: directory, its path relative to root, and the
+    # .gitignore rules in force as (base relative path, rules) pairs
+    stack = [(root, '', [])]
+    while stack:
+        directory, reldir, ignores = stack.pop()
+        if use_gitignore:
+            rules = IgnoreRules.load(directory)
+            if rules is not None:
+                ignores = ignores + [(reldir, rules)]
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"Warning: cannot list {directory}: {e}")
+            continue
+        
+        subdirs = []
+        for entry in entries:
+            relpath = f'{reldir}/{entry.name}' if reldir else entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if not is_dir and not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            if _matches_any(entry.name, relpath, exclude):
+                continue
+            ignored = None
+            for base, rules in ignores:
+                verdict = rules.match(relpath[len(base) + 1:] if base else relpath, is_dir)
+                if verdict is not None:
+                    ignored = verdict
+            if ignored:
+                continue
+            if is_dir:
+                if recursive:
+                    subdirs.append((Path(entry.path), relpath, ignores))
+            elif _matches_any(entry.name, relpath, include):
+                yield Path(entry.path)
+        # Reversed so the stack pops subdirectories in sorted order
+        stack.extend(reversed(subdirs))
+
+def _git(directory: Path, args: List[str]) -> bytes:
+    """Run a git command in directory, returning its stdout"""
+    completed = subprocess.run(['git', *args], cwd=directory, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if completed.returncode != 0:
+        raise RuntimeError(f"git {args[0]} failed: {completed.stderr.decode(errors='replace').strip()}")
+    return completed.stdout
+
+def git_changed_files(directory: Path, rev: Optional[str] = None, staged: bool = False) -> List[Path]:
+    """Files under directory that git reports as added, copied, modified or renamed.
+
+    With staged, the index is compared with HEAD (or rev): what the next
+    commit changes. Otherwise the working tree is compared with rev.
+    """
+    args = ['diff', '--name-only', '-z', '--relative', '--diff-filter=ACMR']
+    if staged:
+        args.append('--cached')
+    if rev:
+        args.append(rev)
+    args.append('--')
+    output = _git(directory, args)
+    return [directory / name for name in os.fsdecode(output).split('\0') if name]
+
+def _gitignored(root: Path, parts: Tuple[str, ...], rules_cache: Dict[Path, Optional[IgnoreRules]],
+                is_dir: bool = False) -> bool:
+    """Whether walk_files would skip root/parts, or a directory on the way to it, for a .gitignore.
+
+    rules_cache maps directories to their loaded rules (None for none).
+    """
+    ignores = []
+    directory = root
+    for depth in range(len(parts)):
+        if directory not in rules_cache:
+            rules_cache[directory] = IgnoreRules.load(directory)
+        if rules_cache[directory] is not None:
+            ignores.append(('/'.join(parts[:depth]), rules_cache[directory]))
+        relpath = '/'.join(parts[:depth + 1])
+        ignored = None
+        for base, rules in ignores:
+            verdict = rules.match(relpath[len(base) + 1:] if base else relpath, depth < len(parts) - 1 or is_dir)
+            if verdict is not None:
+                ignored = verdict
+        if ignored:
+            return True
+        directory = directory / parts[depth]
+    return False
+
+def filter_paths(paths: Iterable[Path], root: Path, include: List[str], exclude: Iterable[str] = (),
+                 recursive: bool = True, use_gitignore: bool = False,
+                 rules_cache: Optional[Dict[Path, Optional[IgnoreRules]]] = None) -> Iterator[Path]:
+    """Apply walk_files' include and exclude rules to an explicit list of files under root.
+
+    With use_gitignore, .gitignore files are applied as well; their parsed
+    rules are kept in rules_cache if one is given.
+    """
+    exclude = DEFAULT_EXCLUDES + list(exclude)
+    if rules_cache is None:
+        rules_cache = {}
+    for path in paths:
+        parts = path.relative_to(root).parts
+        if not recursive and len(parts) > 1:
+            continue
+        relpaths = ['/'.join(parts[:depth]) for depth in range(1, len(parts) + 1)]
+        if any(_matches_any(part, relpath, exclude) for part, relpath in zip(parts, relpaths)):
+            continue
+        if not _matches_any(parts[-1], relpaths[-1], include):
+            continue
+        if use_gitignore and _gitignored(root, parts, rules_cache):
+            continue
+        yield path
+
+def pruned_dir(directory: Path, root: Path, exclude: Iterable[str] = (), use_gitignore: bool = False,
+               rules_cache: Optional[Dict[Path, Optional[IgnoreRules]]] = None) -> bool:
+    """Whether walk_files would not descend into directory, a directory under root.
+
+    Takes the same rules as filter_paths, for watchers deciding which
+    directories to watch.
+    """
+    parts = directory.relative_to(root).parts
+    if not parts:
+        return False
+    exclude = DEFAULT_EXCLUDES + list(exclude)
+    relpaths = ['/'.join(parts[:depth]) for depth in range(1, len(parts) + 1)]
+    if any(_matches_any(part, relpath, exclude) for part, relpath in zip(parts, relpaths)):
+        return True
+    return use_gitignore and _gitignored(root, parts, {} if rules_cache is None else rules_cache, True)
+
+def read_index_blobs(directory: Path, paths: Iterable[Path]) -> Iterator[Tuple[Path, bytes]]:
+    """Yield (path, staged content) for each path, read from the git index.
+
+    One 'git ls-files --stage' call maps the paths to blob ids, and a single
+    'git cat-file --batch' process then streams every blob, so nothing is
+    checked out and the working tree is never touched.
+    """
+    paths = list(paths)
+    if not paths:
+        return
+    by_name = {os.fsencode(path.relative_to(directory).as_posix()): path for path in paths}
+    # Listing the whole index under directory is fast and avoids command-line limits
+    output = _git(directory, ['ls-files', '--stage', '-z'])
+    blobs = []
+    for entry in output.split(b'\0'):
+        if entry:
+            info, name = entry.split(b'\t', 1)
+            _mode, blob_id, stage = info.split()
+            # Conflicted entries have stages 1-3 and no single staged version
+            if stage == b'0' and name in by_name:
+                blobs.append((by_name[name], blob_id))
+    
+    process = subprocess.Popen(['git', 'cat-file', '--batch'], cwd=directory,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        # One request at a time: each reply is read before the next is sent,
+        # so neither pipe can fill up and deadlock
+        for path, blob_id in blobs:
+            process.stdin.write(blob_id + b'\n')
+            process.stdin.flush()
+            header = process.stdout.readline().split()
+            if len(header) != 3 or header[1] != b'blob':
+                raise RuntimeError(f"git cat-file could not read {path}")
+            data = process.stdout.read(int(header[2]))
+            process.stdout.read(1)
+            yield path, data
+    finally:
+        process.stdin.close()
+        process.stdout.close()
+        process.wait()
+
+def read_file_list(stream, separator: bytes = b'\n', chunk_size: int = 64 * 1024) -> Iterator[str]:
+    """Lazily yield the paths listed in a binary stream, one per separator.
+
+    Newline-separated lists may use CRLF line endings; blank entries are
+    skipped. Names are decoded as the OS does (os.fsdecode), so lists from
+    find -print0 round-trip on POSIX.
+    """
+    pending = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        entries = (pending + chunk).split(separator)
+        pending = entries.pop()
+        for entry in entries:
+            if separator == b'\n':
+                entry = entry.rstrip(b'\r')
+            if entry:
+                yield os.fsdecode(entry)
+    if separator == b'\n':
+        pending = pending.rstrip(b'\r')
+    if pending:
+        yield os.fsdecode(pending)
+
+def unique_paths(names: Iterable[str]) -> Iterator[Path]:
+    """Yield each path once, however it is spelled (a/./b and a/b are the same).
+
+    Only a 16-byte digest of each normalized name is kept: about 80 bytes
+    per entry whatever the path length, and the list itself is never held.
+    """
+    seen = set()
+    for name in names:
+        key = hashlib.blake2b(os.fsencode(os.path.normcase(os.path.normpath(name))), digest_size=16).digest()
+        if key not in seen:
+            seen.add(key)
+            yield Path(name)
+
+def _line_buffer_stdout():
+    """Flush stdout at each newline, if it is a console or file stream.
+
+    Redirected streams (io.StringIO under contextlib.redirect_stdout) and
+    a missing one (None under pythonw) are left as they are.
+    """
+    if isinstance(sys.stdout, io.TextIOWrapper):
+        sys.stdout.reconfigure(line_buffering=True, write_through=False)
+
+def _init_worker(engine: ReplacementEngine, messages_to_stderr: bool = False):
+    """Install the parent's engine and line-buffer output so messages do not interleave mid-line"""
+    global ENGINE
+    # Spawned workers re-import the module, which would load the default mapping
+    ENGINE = engine
+    if messages_to_stderr:
+        # stdout carries the parent's report stream
+        sys.stdout = sys.stderr
+    _line_buffer_stdout()
+
+def _process_timed(filepath: Path, options: Dict, profile: bool = False) -> Optional[Dict]:
+    """process_file, recording the wall-clock seconds it took in the result.
+
+    With profile set, the result also carries the per-phase timings.
+    """
+    global _ACTIVE_TIMER
+    timer = _ACTIVE_TIMER = PhaseTimer() if profile else None
+    started = time.perf_counter()
+    try:
+        result = process_file(filepath, **options)
+    finally:
+        _ACTIVE_TIMER = None
+    if result is not None:
+        result['seconds'] = time.perf_counter() - started
+        if timer is not None:
+            result['profile'] = {'phases': timer.phases, 'events': timer.events, 'pid': timer.pid, 'started': started}
+    return result
+
+def _process_chunk(filepaths: List[Path], options: Dict, profile: bool = False) -> List[Optional[Dict]]:
+    """Worker entry point: process a batch of files in one round trip"""
+    return [_process_timed(filepath, options, profile) for filepath in filepaths]
+
+# Manager threads of pools closed early, joined by main() before the interpreter exits
+_ABANDONED_POOLS = []
+
+def _shutdown_pool(executor, wait: bool = True):
+    """Shut an executor down; without wait, queued work is cancelled and running work is not waited for"""
+    if wait:
+        executor.shutdown()
+        return
+    manager = getattr(executor, '_executor_manager_thread', None)
+    executor.shutdown(wait=False, cancel_futures=True)
+    if manager is not None:
+        _ABANDONED_POOLS.append(manager)
+
+def _join_abandoned_pools():
+    """Wait for the work still running in process pools closed early.
+
+    concurrent.futures joins them at exit as well, but its wakeup there can
+    race with a pool closing its own pipe and print an OSError traceback.
+    """
+    while _ABANDONED_POOLS:
+        _ABANDONED_POOLS.pop().join()
+
+def process_files(files: Iterable[Path], jobs: int = 1, chunksize: int = 1, profile: bool = False,
+                  engine: Optional[ReplacementEngine] = None, **options) -> Iterator[Tuple[Path, Optional[Dict]]]:
+    """Process files, fanning out to a process pool when jobs > 1.
+
+    Yields (filepath, result) pairs in input order. Keyword options are
+    passed through to process_file. Files are sent to workers in chunks,
+    and only a bounded number of chunks is in flight at once. Workers get
+    the engine once, through the pool initializer.
+    """
+    if jobs <= 1:
+        options['engine'] = engine
+        for filepath in files:
+            yield filepath, _process_timed(filepath, options, profile)
+        return
+    
+    files = iter(files)
+    # Forked workers would otherwise inherit (and repeat) unflushed output
+    sys.stdout.flush()
+    executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                   initargs=(engine or ENGINE, sys.stdout is sys.stderr))
+    pending = deque()
+    completed = False
+    try:
+        while True:
+            # Keep every worker busy with one queued chunk behind it
+            while len(pending) < jobs * 2:
+                chunk = list(islice(files, chunksize))
+                if not chunk:
+                    break
+                pending.append((chunk, executor.submit(_process_chunk, chunk, options, profile)))
+            if not pending:
+                break
+            chunk, future = pending.popleft()
+            yield from zip(chunk, future.result())
+        completed = True
+    finally:
+        # Closed early (e.g. --fail-fast, Ctrl+C): queued chunks never start,
+        # and the caller does not wait for the ones already running
+        _shutdown_pool(executor, wait=completed)
+
+class _LineWriter:
+    """Stream wrapper that writes whole lines only, for messages printed from several threads.
+
+    print() writes the text and the newline separately, so two threads can
+    otherwise interleave mid-line.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._pending = threading.local()
+
+    def write(self, text: str) -> int:
+        pending = getattr(self._pending, 'text', '') + text
+        lines, newline, self._pending.text = pending.rpartition('\n')
+        if newline:
+            with self._lock:
+                self.stream.write(lines + newline)
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def _timed_call(func, *args) -> Tuple[object, Tuple[float, float, float]]:
+    """Run one pipeline stage, returning its value and (start, wall, CPU) seconds"""
+    started, cpu = time.perf_counter(), time.thread_time()
+    value = func(*args)
+    return value, (started, time.perf_counter() - started, time.thread_time() - cpu)
+
+def _pipeline_read(filepath: Path, options: Dict, opener) -> Tuple[Optional[bytes], Optional[Dict]]:
+    """Read stage: the file's bytes, or the finished result of a streamed large file"""
+    try:
+        data = _read_file(filepath, options.get('stream_threshold', STREAM_THRESHOLD), opener)
+        if data is None:
+            return None, process_large_file(
+                filepath, options.get('preview_only', False), options.get('create_backup', True),
+                options.get('track_state', False), options.get('backup_dir'), options.get('engine'),
+            )
+    except Exception as e:
+        print(f"Error reading {filepath}: {e}")
+        return None, None
+    return data, None
+
+async def _pipeline(files: Iterable[Path], finished: asyncio.Queue, io_pool: ThreadPoolExecutor,
+                    cpu_pool, cpu_engine: Optional[ReplacementEngine], io_threads: int,
+                    profile: bool, opener, options: Dict):
+    """Feed files through read, scan and write stages, putting (filepath, result) on finished.
+
+    None is put when every file is done; an exception is put instead if
+    the run fails.
+    """
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(io_threads)
+    pid = os.getpid()
+    
+    async def stage(executor, name: str, timings: Dict, func, *args):
+        value, (started, wall, cpu) = await loop.run_in_executor(executor, _timed_call, func, *args)
+        timings['phases'][name] = [wall, cpu]
+        timings['events'].append((name, started, wall))
+        return value
+    
+    async def handle(filepath: Path):
+        try:
+            started = time.perf_counter()
+            timings = {'phases': {}, 'events': [], 'pid': pid, 'started': started}
+            if options.get('check_only'):
+                data, result = None, await stage(io_pool, 'check', timings, check_file, filepath)
+            else:
+                data, result = await stage(io_pool, 'read', timings, _pipeline_read, filepath, options, opener)
+            if data is not None:
+                result, new_data = await stage(cpu_pool, 'scan', timings, _scan_data, filepath, data,
+                                               options.get('report_locations', 0), cpu_engine,
+                                               options.get('sample_unmapped', False), options.get('diff', False))
+                result = await stage(io_pool, 'write', timings, _commit_result, filepath, data, new_data, result,
+                                     options.get('preview_only', False), options.get('create_backup', True),
+                                     options.get('track_state', False), options.get('backup_dir'))
+            if result is not None:
+                result['seconds'] = time.perf_counter() - started
+                if profile:
+                    result['profile'] = timings
+            # Blocks while the consumer is behind, holding this file's slot
+            await finished.put((filepath, result))
+        finally:
+            slots.release()
+    
+    tasks = set()
+    try:
+        for filepath in files:
+            # Backpressure: no more than io_threads files are read but not yet consumed
+            await slots.acquire()
+            task = loop.create_task(handle(filepath))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        raise
+    except Exception as e:
+        for task in tasks:
+            task.cancel()
+        await finished.put(e)
+        return
+    await finished.put(None)
+
+def process_files_pipelined(files: Iterable[Path], jobs: int = 1, io_threads: int = PIPELINE_IO_THREADS,
+                            profile: bool = False, engine: Optional[ReplacementEngine] = None, opener=open,
+                            **options) -> Iterator[Tuple[Path, Optional[Dict]]]:
+    """Process files through an asyncio pipeline that overlaps I/O with replacement.
+
+    For network shares, where every open, read and write waits on the
+    server. Reads, backups and writes run on io_threads threads, with at
+    most io_threads files in flight; replacement runs on jobs worker
+    processes (one thread if jobs is 1). opener replaces open() for reads,
+    for example to inject latency in tests. Keyword options are those of
+    process_file. Yields (filepath, result) pairs as files finish, which is
+    not necessarily input order.
+    """
+    engine = engine or ENGINE
+    io_pool = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='unicode-io')
+    if jobs > 1:
+        sys.stdout.flush()
+        cpu_pool = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                       initargs=(engine, sys.stdout is sys.stderr))
+        # Workers have the engine installed as their ENGINE
+        cpu_engine = None
+    else:
+        cpu_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='unicode-cpu')
+        cpu_engine = engine
+    options['engine'] = engine
+    
+    # The loop runs only while the caller waits for the next result, so the
+    # file iterator (and anything it updates) stays on the caller's thread
+    stdout = sys.stdout
+    sys.stdout = _LineWriter(stdout)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    finished = asyncio.Queue(maxsize=io_threads)
+    pipeline = loop.create_task(_pipeline(files, finished, io_pool, cpu_pool, cpu_engine,
+                                          io_threads, profile, opener, options))
+    completed = False
+    try:
+        while True:
+            item = loop.run_until_complete(finished.get())
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+        completed = True
+    finally:
+        # Closed early: stop feeding files and let cancelled stages unwind
+        pipeline.cancel()
+        loop.run_until_complete(asyncio.gather(*asyncio.all_tasks(loop), return_exceptions=True))
+        asyncio.set_event_loop(None)
+        loop.close()
+        # As in process_files, an early close does not wait for running stages
+        _shutdown_pool(io_pool, wait=completed)
+        _shutdown_pool(cpu_pool, wait=completed)
+        sys.stdout = stdout
+
+class Replacer:
+    """Library entry point: a compiled mapping reused across calls.
+
+    Creating a Replacer is the only point where a mapping is compiled, so a
+    service can keep one for its lifetime instead of starting the script
+    per file. Methods are safe to call from several threads.
+
+        replacer = Replacer()                    # built-ins + Config/UnicodeReplacements.json
+        replacer = Replacer({'✓': '[YES]'})      # extra entries layered on top
+        replacer.replace('Done ✓')               # 'Done [YES]'
+    """
+
+    def __init__(self, mapping: Optional[Dict[str, str]] = None,
+                 mapping_path: Optional[Union[str, Path]] = MAPPING_PATH):
+        mapping_path = Path(mapping_path) if mapping_path else None
+        if mapping is None and mapping_path == MAPPING_PATH:
+            # Compiled (or loaded from its cache) when the module was imported
+            self.engine = ENGINE
+        elif mapping is None:
+            self.engine = load_engine(mapping_path)
+        else:
+            layers = dict(REPLACEMENTS)
+            if mapping_path is not None and (mapping_path != MAPPING_PATH or mapping_path.exists()):
+                layers.update(load_mapping(mapping_path.read_bytes()))
+            layers.update(mapping)
+            self.engine = ReplacementEngine(layers)
+
+    def replace(self, text: str) -> str:
+        """Return text with every non-ASCII character or sequence replaced"""
+        if text.isascii():
+            return text
+        return self.engine.transform(text)[0]
+
+    def replace_bytes(self, data: bytes, encoding: Optional[str] = None) -> bytes:
+        """Replace in encoded content, returning ASCII bytes.
+
+        Without an encoding it is detected as for files: BOM, UTF-8, then cp1252.
+        """
+        if data.isascii() and encoding is None:
+            return data
+        if (encoding in (None, 'utf-8') and sniff_encoding(data) in (None, 'utf-8')
+                and non_ascii_density(data) <= BYTES_PATH_MAX_DENSITY):
+            transformed = self.engine.transform_bytes(data)
+            if transformed is not None:
+                return transformed[0]
+        text = data.decode(encoding) if encoding else decode_bytes(data)[0]
+        return self.replace(text).encode('ascii')
+
+    def scan(self, content: Union[str, bytes], locations: int = 0) -> Dict:
+        """Report what replace() would change.
+
+        Returns unicode_count plus counts, replacements and first_lines keyed
+        by character or sequence. When locations is set, 'locations' holds up
+        to that many UnicodeHit objects.
+        """
+        text = content if isinstance(content, str) else decode_bytes(content)[0]
+        _, counts, first_offsets, replacements = self.engine.transform(text)
+        result = {
+            'unicode_count': sum(len(token) * count for token, count in counts.items()),
+            'counts': counts,
+            'replacements': replacements,
+            'first_lines': _offsets_to_lines(text, first_offsets),
+        }
+        if locations:
+            result['locations'] = list(islice(iter_unicode_chars(text), locations))
+        return result
+
+    def process_paths(self, paths: Iterable[Union[str, Path]], include: Iterable[str] = ('*.ps1',),
+                      exclude: Iterable[str] = (), jobs: int = 1,
+                      **options) -> Iterator[Tuple[Path, Optional[Dict]]]:
+        """Process files in place, expanding directories with the CLI's walker.
+
+        Keyword options are those of process_file (preview_only,
+        create_backup, backup_dir, ...). Yields (path, result) pairs lazily,
+        in input order.
+        """
+        include = list(include)
+        files = chain.from_iterable(
+            walk_files(path, include, exclude) if path.is_dir() else (path,)
+            for path in map(Path, paths)
+        )
+        return process_files(files, jobs, 16 if jobs > 1 else 1, engine=self.engine, **options)
+
+class InotifyWatcher:
+    """Linux inotify event source reporting files closed after writing or moved in"""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self, root: Path, recursive: bool = True, prune: Optional[Callable[[Path], bool]] = None):
+        import ctypes
+        import ctypes.util
+        self._ctypes = ctypes
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.recursive = recursive
+        # Directories for which prune returns True are neither watched nor walked
+        self.prune = prune
+        self._dirs = {}
+        self._limit_reached = False
+        if not self._add_watch(root):
+            os.close(self.fd)
+            raise OSError(self._ctypes.get_errno(), f'cannot watch {root}')
+        if recursive:
+            self._add_subtree(root)
+
+    def _add_watch(self, directory: Path) -> bool:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd < 0:
+            self._watch_failed(directory, self._ctypes.get_errno())
+            return False
+        self._dirs[wd] = directory
+        return True
+
+    def _watch_failed(self, directory: Path, error: int):
+        """Warn that changes under directory will be missed"""
+        if error in (errno.ENOENT, errno.ENOTDIR):
+            # Removed again before it could be watched; nothing to miss
+            return
+        if error == errno.ENOSPC:
+            # Every further directory would fail the same way; say so once
+            if not self._limit_reached:
+                self._limit_reached = True
+                print(f"Warning: inotify watch limit reached at {directory}; it and further new directories "
+                      f"are not watched (raise fs.inotify.max_user_watches, or --exclude more)")
+            return
+        print(f"Warning: cannot watch {directory}, changes in it will be missed: {os.strerror(error)}")
+
+    def _add_subtree(self, directory: Path) -> List[Path]:
+        """Watch the subdirectories of a watched directory, returning files already inside"""
+        existing = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            kept = []
+            for name in dirnames:
+                path = Path(dirpath) / name
+                if (self.prune is None or not self.prune(path)) and self._add_watch(path):
+                    kept.append(name)
+            # Unwatched directories are not descended into either
+            dirnames[:] = kept
+            existing.extend(Path(dirpath) / name for name in filenames)
+        return existing
+
+    def _add_tree(self, directory: Path) -> List[Path]:
+        """Watch a new directory (and subdirectories), returning files already inside"""
+        if self.prune is not None and self.prune(directory):
+            return []
+        if not self._add_watch(directory):
+            return []
+        return self._add_subtree(directory)
+
+    def poll(self, timeout: float) -> List[Path]:
+        """Wait up to timeout seconds and return the files that changed"""
+        import select
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        buffer = os.read(self.fd, 64 * 1024)
+        changed = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _cookie, length = self._EVENT.unpack_from(buffer, offset)
+            offset += self._EVENT.size
+            name = buffer[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                print("Warning: inotify event queue overflowed, some changes were missed")
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = directory / os.fsdecode(name)
+            if mask & self.IN_ISDIR:
+                # Files written before the new directory was watched are reported now
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO) and self.recursive:
+                    changed.extend(self._add_tree(path))
+            elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                changed.append(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """Portable event source that compares size and mtime snapshots of the tree"""
+
+    def __init__(self, root: Path, recursive: bool = True, interval: float = WATCH_POLL_INTERVAL,
+                 prune: Optional[Callable[[Path], bool]] = None):
+        self.root = root
+        self.recursive = recursive
+        self.interval = interval
+        # Directories for which prune returns True are not scanned
+        self.prune = prune
+        self._next_scan = 0.0
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[Path, Tuple[int, int]]:
+        snapshot = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if self.prune is not None:
+                dirnames[:] = [name for name in dirnames if not self.prune(Path(dirpath) / name)]
+            for name in filenames:
+                path = Path(dirpath) / name
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (st.st_size, st.st_mtime_ns)
+            if not self.recursive:
+                break
+        self._next_scan = time.monotonic() + self.interval
+        return snapshot
+
+    def poll(self, timeout: float) -> List[Path]:
+        """Wait up to timeout seconds and return the files that changed"""
+        delay = self._next_scan - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(0.0, delay))
+        snapshot = self._scan()
+        changed = [path for path, state in snapshot.items() if self._snapshot.get(path) != state]
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+def watch(root: Path, include: List[str], exclude: Iterable[str] = (), recursive: bool = True,
+          use_gitignore: bool = True, workers: int = 1, debounce: float = WATCH_DEBOUNCE,
+          **options) -> Dict[str, int]:
+    """Process matching files as soon as they are written, until interrupted.
+
+    Files are selected by the same rules as a walk (see filter_paths), and
+    directories a walk would prune are not watched at all.
+
+    Events are debounced per file: a file is queued once it has been quiet
+    for `debounce` seconds, so a burst of writes is handled once. A bounded
+    queue feeds a fixed set of worker threads, and files the tool itself
+    just rewrote are recognized by their size and mtime and ignored.
+    """
+    exclude = list(exclude)
+    rules_cache = {}
+    
+    def prune(directory: Path) -> bool:
+        return pruned_dir(directory, root, exclude, use_gitignore, rules_cache)
+    
+    try:
+        watcher = InotifyWatcher(root, recursive, prune)
+        source = 'inotify'
+    except (OSError, AttributeError, TypeError):
+        watcher = PollingWatcher(root, recursive, prune=prune)
+        source = f'polling every {watcher.interval:g}s'
+    
+    work = queue.Queue(maxsize=workers * 64)
+    own_writes = {}
+    # Bounded: a daemon can run for months
+    latencies = deque(maxlen=WATCH_LATENCY_SAMPLES)
+    lock = threading.Lock()
+    stats = {'processed': 0, 'files_with_unicode': 0, 'replacements': 0, 'errors': 0,
+             'latency_count': 0, 'latency_max': 0.0}
+    
+    def worker():
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            filepath, first_seen = item
+            try:
+                st = os.stat(filepath)
+            except OSError:
+                continue
+            with lock:
+                if own_writes.get(filepath) == (st.st_size, st.st_mtime_ns):
+                    continue
+            started = time.monotonic()
+            try:
+                result = process_file(filepath, **options)
+            except Exception as e:
+                # A dead worker would leave the bounded queue to fill and stall the watcher
+                print(f"Error processing {filepath}: {e}")
+                with lock:
+                    stats['errors'] += 1
+                continue
+            finished = time.monotonic()
+            if not result:
+                with lock:
+                    stats['errors'] += 1
+                continue
+            with lock:
+                stats['processed'] += 1
+                if result['status'] in ('error', 'write_error'):
+                    stats['errors'] += 1
+                if result['unicode_count'] > 0:
+                    stats['files_with_unicode'] += 1
+                    stats['replacements'] += result['unicode_count']
+                    latencies.append(finished - first_seen)
+                    stats['latency_count'] += 1
+                    stats['latency_max'] = max(stats['latency_max'], finished - first_seen)
+                    try:
+                        st = os.stat(filepath)
+                        own_writes[filepath] = (st.st_size, st.st_mtime_ns)
+                    except OSError:
+                        pass
+            if result['unicode_count'] > 0:
+                print(f"{filepath}: {result['unicode_count']} replacements, "
+                      f"latency {(finished - first_seen) * 1000:.1f}ms "
+                      f"(processing {(finished - started) * 1000:.1f}ms)")
+    
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    
+    print(f"Watching {root} for '{', '.join(include)}' ({source}, debounce {debounce * 1000:g}ms). "
+          f"Press Ctrl+C to stop.")
+    pending = {}
+    try:
+        while True:
+            events = watcher.poll(debounce if pending else WATCH_POLL_INTERVAL)
+            now = time.monotonic()
+            for filepath in events:
+                if filepath.name == '.gitignore':
+                    rules_cache.pop(filepath.parent, None)
+            for filepath in filter_paths(events, root, include, exclude, recursive, use_gitignore, rules_cache):
+                first_seen = pending.get(filepath, (now, now))[0]
+                pending[filepath] = (first_seen, now)
+            for filepath, (first_seen, last_seen) in list(pending.items()):
+                if now - last_seen >= debounce:
+                    del pending[filepath]
+                    # Blocks when the workers fall behind, pausing event intake
+                    work.put((filepath, first_seen))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for _ in threads:
+            work.put(None)
+        for thread in threads:
+            thread.join()
+        watcher.close()
+    
+    if latencies:
+        latencies = sorted(latencies)
+        median = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        window = '' if len(latencies) == stats['latency_count'] else f" (last {len(latencies)} of {stats['latency_count']})"
+        print(f"Latency over {stats['latency_count']} files: median {median * 1000:.1f}ms{window}, "
+              f"p95 {p95 * 1000:.1f}ms, max {stats['latency_max'] * 1000:.1f}ms")
+    return stats
+
+def _skip_cached(files: Iterable[Path], cache: ScanCache, preview_only: bool, stats: Dict,
+                 report: Optional['ReportWriter'] = None) -> Iterator[Path]:
+    """Drop files the cache shows as unchanged, counting them into stats.
+
+    Files that still contain Unicode are only skipped in preview mode.
+    """
+    for filepath in files:
+        entry = cache.lookup(filepath)
+        if entry and (entry['unicode_count'] == 0 or preview_only):
+            stats['cached'] += 1
+            if entry['unicode_count'] > 0:
+                stats['files_with_unicode'] += 1
+                stats['replacements'] += entry['unicode_count']
+            if report is not None:
+                report.write({'type': 'file', 'path': str(filepath), 'status': 'unchanged',
+                              'unicode_count': entry['unicode_count']})
+        else:
+            yield filepath
+
+def _code_key(token: str) -> str:
+    """Report key for a character or sequence, e.g. 'U+26A0 U+FE0F'"""
+    return ' '.join(f'U+{ord(char):04X}' for char in token)
+
+def report_record(filepath: Path, result: Optional[Dict]) -> Dict:
+    """JSON-ready record for one processed file"""
+    if result is None:
+        return {'type': 'file', 'path': str(filepath), 'status': 'read_error'}
+    record = {
+        'type': 'file',
+        'path': str(filepath),
+        'status': result['status'],
+        'encoding': result.get('encoding'),
+        'unicode_count': result['unicode_count'],
+        'counts': {_code_key(token): count for token, count in result['replacement_counts'].items()},
+        'replacements': {_code_key(token): replacement for token, replacement in result['replacements']},
+        'first_lines': {_code_key(token): line for token, line in result.get('first_lines', {}).items()},
+        'bytes_in': result.get('bytes_in'),
+        'bytes_out': result.get('bytes_out'),
+        'seconds': round(result.get('seconds', 0.0), 6),
+    }
+    if 'first_non_ascii' in result:
+        line, column = result['first_non_ascii']
+        record['first_non_ascii'] = {'line': line, 'column': column}
+    return record
+
+class ReportWriter:
+    """Streams per-file records as NDJSON lines or as one JSON document.
+
+    Records are written as files finish, and the summary closes the stream:
+    as the last line in NDJSON, or as the "summary" member after the
+    "files" array in JSON.
+    """
+
+    FLUSH_INTERVAL = 0.1
+
+    def __init__(self, stream, fmt: str = 'ndjson'):
+        self.stream = stream
+        self.format = fmt
+        self.count = 0
+        self._flushed = time.monotonic()
+        if fmt == 'json':
+            stream.write('{"files": [')
+
+    def write(self, record: Dict):
+        line = json.dumps(record)
+        if self.format == 'json':
+            self.stream.write(('\n  ' if self.count == 0 else ',\n  ') + line)
+        else:
+            self.stream.write(line + '\n')
+        self.count += 1
+        # Readers tailing the stream see records promptly without a flush per file
+        now = time.monotonic()
+        if now - self._flushed >= self.FLUSH_INTERVAL:
+            self.stream.flush()
+            self._flushed = now
+
+    def close(self, summary: Dict):
+        if self.format == 'json':
+            self.stream.write(f'\n], "summary": {json.dumps(summary)}}}\n')
+        else:
+            self.stream.write(json.dumps({'type': 'summary', **summary}) + '\n')
+        self.stream.flush()
+
+def _percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[min(len(values), int(rank)) - 1]
+
+class RunProfile:
+    """Merges per-file phase timings into the --profile summary and trace.
+
+    The parent's own phases (walking the tree, cache bookkeeping) are timed
+    here directly; file phases arrive with each result, from whichever
+    process handled the file.
+    """
+
+    def __init__(self, trace: bool = False):
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        self.timer = PhaseTimer()
+        self.wall = Counter()
+        self.cpu = Counter()
+        self.latencies = []
+        self.files = 0
+        self.bytes_in = 0
+        self.trace_events = [] if trace else None
+
+    def iterate(self, iterable: Iterable, name: str) -> Iterator:
+        """Yield from iterable, timing each step as phase name"""
+        iterator = iter(iterable)
+        done = object()
+        while True:
+            with self.timer.phase(name):
+                item = next(iterator, done)
+            if item is done:
+                return
+            yield item
+
+    def add(self, filepath: Path, result: Optional[Dict]):
+        self.files += 1
+        if result is None:
+            return
+        self.bytes_in += result.get('bytes_in', 0)
+        self.latencies.append(result['seconds'])
+        profile = result.get('profile')
+        if profile is None:
+            return
+        for name, (wall, cpu) in profile['phases'].items():
+            self.wall[name] += wall
+            self.cpu[name] += cpu
+        if self.trace_events is not None:
+            self._trace(profile['pid'], profile['events'], str(filepath))
+            self._trace(profile['pid'], [('file', profile['started'], result['seconds'])], str(filepath))
+
+    def _trace(self, pid: int, events: List[Tuple[str, float, float]], path: Optional[str] = None):
+        for name, start, duration in events:
+            event = {'name': name, 'cat': 'file' if name == 'file' else 'phase', 'ph': 'X', 'pid': pid, 'tid': pid,
+                     'ts': round((start - self.started) * 1e6, 3), 'dur': round(duration * 1e6, 3)}
+            if path is not None:
+                event['args'] = {'path': path}
+            self.trace_events.append(event)
+
+    def print_summary(self):
+        elapsed = time.perf_counter() - self.started
+        wall_times, cpu_times = self.wall.copy(), self.cpu.copy()
+        for name, (wall, cpu) in self.timer.phases.items():
+            wall_times[name] += wall
+            cpu_times[name] += cpu
+        total = sum(wall_times.values()) or 1.0
+        print(f"\n{'='*60}")
+        print("PROFILE")
+        print(f"{'='*60}")
+        print(f"{'Phase':<12}{'Wall (s)':>12}{'CPU (s)':>12}{'Share':>9}")
+        for name, wall in wall_times.most_common():
+            print(f"{name:<12}{wall:>12.4f}{cpu_times[name]:>12.4f}{wall / total:>9.1%}")
+        print(f"Elapsed: {elapsed:.4f}s wall, {time.process_time() - self.cpu_started:.4f}s CPU in the main process")
+        print(f"Throughput: {self.bytes_in / elapsed / 1e6:.2f} MB/s, {self.files / elapsed:.1f} files/s "
+              f"({self.files} files, {self.bytes_in} bytes)")
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            print("Per-file latency: " + ', '.join(
+                f"p{percent} {_percentile(latencies, percent) * 1000:.3f}ms" for percent in (50, 95, 99)
+            ) + f", max {latencies[-1] * 1000:.3f}ms")
+
+    def write_trace(self, path: str):
+        """Write Chrome trace-event JSON (chrome://tracing, Perfetto)"""
+        self._trace(self.timer.pid, self.timer.events)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': self.trace_events, 'displayTimeUnit': 'ms'}, f)
+
+def _listed_files(source: str, separator: bytes) -> Iterator[Path]:
+    """The unique paths listed in source ('-' for stdin), read as they are needed"""
+    if source == '-':
+        yield from unique_paths(read_file_list(sys.stdin.buffer, separator))
+        return
+    with open(source, 'rb') as stream:
+        yield from unique_paths(read_file_list(stream, separator))
+
+class UnmappedHistogram:
+    """Corpus-wide counts of characters that have no mapping, for --unmapped.
+
+    Workers already count every character of each file, so this only sums
+    the unmapped entries of the per-file counts as results arrive: no second
+    scan. It keeps a total, a file count and a few sample lines per
+    character.
+    """
+
+    def __init__(self, samples: int = UNMAPPED_SAMPLES):
+        self.counts = Counter()
+        self.files = Counter()
+        self.samples = {}
+        self.max_samples = samples
+
+    def add(self, filepath: Path, result: Optional[Dict]):
+        if not result:
+            return
+        counts = result['replacement_counts']
+        first_lines = result.get('first_lines', {})
+        contexts = result.get('unmapped_samples', {})
+        for token, replacement in result['replacements']:
+            if not is_fallback(token, replacement):
+                continue
+            self.counts[token] += counts[token]
+            self.files[token] += 1
+            samples = self.samples.setdefault(token, [])
+            if len(samples) < self.max_samples and token in contexts:
+                samples.append({'path': str(filepath), 'line': first_lines.get(token), 'context': contexts[token]})
+
+    def top(self, limit: Optional[int] = UNMAPPED_TOP) -> List[Dict]:
+        """The most frequent unmapped characters, JSON-ready"""
+        return [
+            {
+                'code': f'U+{ord(char):04X}',
+                'name': unicodedata.name(char, ''),
+                'count': count,
+                'files': self.files[char],
+                'samples': self.samples.get(char, []),
             }
+            for char, count in self.counts.most_common(limit)
+        ]
+
+    def print_summary(self, limit: int = UNMAPPED_TOP):
+        print(f"\n{'='*60}")
+        print(f"UNMAPPED CHARACTERS ({len(self.counts)} distinct)")
+        print(f"{'='*60}")
+        for entry in self.top(limit):
+            print(f"{entry['code']:<9} {entry['count']:>8}x in {entry['files']} files  {entry['name'] or '(no name)'}")
+            for sample in entry['samples']:
+                try:
+                    print(f"    {sample['path']}:{sample['line']}: {sample['context']}")
+                except UnicodeEncodeError:
+                    print(f"    {sample['path']}:{sample['line']}")
+        if len(self.counts) > limit:
+            print(f"... and {len(self.counts) - limit} more")
+
+    def stubs(self) -> Dict:
+        """Mapping entries for every unmapped character, in Config/UnicodeReplacements.json form.
+
+        Replacements are guessed from the Unicode name ([GRINNING_FACE]) and
+        are meant to be reviewed before the entries are merged.
+        """
+        entries = {}
+        for char, _ in self.counts.most_common():
+            name = re.sub(r'[^A-Z0-9]+', '_', unicodedata.name(char, '')).strip('_')
+            entries[char] = f'[{name}]' if name else fallback_replacement(char)
+        return {'replacements': {'unmapped': entries}}
+
+    def write_stubs(self, path: str):
+        text = json.dumps(self.stubs(), indent=2, ensure_ascii=True)
+        # Upper-case escapes, as in the shipped mapping file
+        text = re.sub(r'\\u[0-9a-f]{4}', lambda match: match.group().upper().replace('\\U', '\\u'), text)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+def _print_result(filepath: Path, result: Dict, preview_only: bool):
+    """Print the per-file details shown in verbose and preview mode"""
+    print(f"\n{filepath}:")
+    print(f"  Found {result['unicode_count']} Unicode characters")
     
+    for line, column, code, context in result.get('locations', []):
+        try:
+            print(f"  Line {line}, Col {column}: {code}  {context}")
+        except UnicodeEncodeError:
+            print(f"  Line {line}, Col {column}: {code}")
+    
+    if preview_only:
+        # Show sample replacements
+        counts = result['replacement_counts']
+        first_lines = result.get('first_lines', {})
+        for char, replacement in result['replacements'][:5]:
+            detail = f"x{counts[char]}"
+            if char in first_lines:
+                detail += f", first on line {first_lines[char]}"
+            try:
+                print(f"  {char} -> {replacement} ({detail})")
+            except UnicodeEncodeError:
+                print(f"  {describe_codes(char)} -> {replacement} ({detail})")
+        
+        if len(result['replacements']) > 5:
+            print(f"  ... and {len(result['replacements']) - 5} more unique replacements")
+
+def _report_summary(stats: Dict, preview_only: bool, started: float, check: bool = False) -> Dict:
+    """Closing record of a --report stream"""
+    if stats['errors'] > 0:
+        status = 'error'
+    elif check and stats['files_with_unicode']:
+        status = 'unicode_found'
+    else:
+        status = 'ok'
     return {
-        'file': filepath,
-        'unicode_count': len(unicode_chars),
-        'replacements': replacements,
-        'status': 'success'
+        **stats,
+        'preview': preview_only,
+        'seconds': round(time.perf_counter() - started, 6),
+        'status': status,
     }
 
-def main():
+def main(argv: Optional[List[str]] = None):
     parser = argparse.ArgumentParser(
         description='Replace Unicode characters with ASCII equivalents in PowerShell scripts',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -285,89 +2883,413 @@ Examples:
   %(prog)s script.ps1                    # Process single file
   %(prog)s C:\\Scripts                    # Process all .ps1 files in directory
   %(prog)s C:\\Scripts --preview          # Preview changes without modifying
+  %(prog)s . --diff fix.patch            # Write the changes as a patch for git apply
   %(prog)s C:\\Scripts --pattern "*.txt"  # Process .txt files
+  %(prog)s . --include "*.ps1" --include "*.psm1" --exclude "vendor"
   %(prog)s script.ps1 --no-backup       # Skip backup creation
+  %(prog)s C:\\Scripts --jobs 4           # Use 4 worker processes
+  %(prog)s C:\\Scripts --cache            # Skip files unchanged since the last run
+  %(prog)s C:\\Scripts --watch            # Fix files as soon as they are written
+  %(prog)s . --git-staged --preview      # Pre-commit: scan staged content only
+  %(prog)s . --check --fail-fast         # CI gate: exit 3 at the first non-ASCII file
+  %(prog)s . --git-diff origin/main      # CI: files changed since origin/main
+  find . -name '*.ps1' -print0 | %(prog)s --files-from - -0
         """
     )
     
-    parser.add_argument('path', help='File or directory to process')
+    parser.add_argument('path', nargs='?',
+                        help='File or directory to process; with --files-from, the directory holding the '
+                             'backup store and cache (default: current directory)')
     parser.add_argument('--preview', action='store_true', help='Preview changes without modifying files')
+    parser.add_argument('--check', action='store_true',
+                        help=f'Only check for non-ASCII content, reading each file up to its first high-bit byte; '
+                             f'nothing is written. Exits with {EXIT_UNICODE_FOUND} if any file has some')
+    parser.add_argument('--diff', nargs='?', const='-', metavar='FILE',
+                        help='Write the changes as one unified diff to FILE (default: stdout) instead of '
+                             'rewriting files, for review and git apply')
+    parser.add_argument('--fail-fast', action='store_true',
+                        help='With --check, stop at the first offending file and cancel the remaining work')
     parser.add_argument('--no-backup', action='store_true', help='Skip creating backup files')
+    parser.add_argument('--backup-dir', metavar='DIR',
+                        help=f'Content-addressed backup store (default: {BACKUP_DIRNAME} in the target directory)')
+    parser.add_argument('--sibling-backups', action='store_true',
+                        help='Write timestamped .backup_ copies next to each file instead of using the store')
     parser.add_argument('--pattern', default='*.ps1', help='File pattern to match (default: *.ps1)')
+    parser.add_argument('--include', action='append', metavar='GLOB',
+                        help='Process files matching GLOB; repeatable, replaces --pattern')
+    parser.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+                        help='Skip files and directories matching GLOB; repeatable')
+    parser.add_argument('--no-gitignore', action='store_true', help='Do not apply .gitignore files')
     parser.add_argument('--recursive', action='store_true', default=True, help='Process subdirectories (default: True)')
     parser.add_argument('--verbose', action='store_true', help='Show detailed output')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help='Number of worker processes (default: CPU count)')
+    parser.add_argument('--io-threads', type=int, default=0, metavar='N',
+                        help='Overlap the reads and writes of up to N files in an asyncio pipeline; '
+                             'for network shares where each file waits on the server (default: off)')
+    parser.add_argument('--stream-threshold', type=int, default=STREAM_THRESHOLD, metavar='BYTES',
+                        help=f'Stream files of at least this size in chunks (default: {STREAM_THRESHOLD})')
+    parser.add_argument('--cache', nargs='?', const='', default=None, metavar='FILE',
+                        help=f'Skip files unchanged since the last run, using an index stored in FILE '
+                             f'(default: {CACHE_FILENAME} in the target directory)')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and process matching files as soon as they are written; '
+                             '--include, --exclude and .gitignore files apply as for a walk')
+    parser.add_argument('--debounce', type=float, default=WATCH_DEBOUNCE * 1000, metavar='MS',
+                        help=f'Watch mode: wait for MS milliseconds of quiet before processing a file '
+                             f'(default: {WATCH_DEBOUNCE * 1000:g})')
+    parser.add_argument('--mapping', metavar='FILE',
+                        help='Replacement mapping JSON layered over the built-in table '
+                             '(default: Config/UnicodeReplacements.json next to this script)')
+    parser.add_argument('--report', choices=REPORT_FORMATS,
+                        help='Stream a machine-readable record per file and a final summary; '
+                             'console messages move to stderr unless --report-file is given')
+    parser.add_argument('--report-file', metavar='FILE', help='Write the --report stream to FILE instead of stdout')
+    parser.add_argument('--files-from', metavar='FILE',
+                        help="Process exactly the files listed in FILE, one per line ('-' reads stdin); "
+                             "listed files are not filtered by pattern and duplicates are skipped")
+    parser.add_argument('-0', '--null', action='store_true',
+                        help='--files-from entries are separated by NUL characters instead of newlines')
+    parser.add_argument('--git-staged', action='store_true',
+                        help='Only process files staged for commit; with --preview the staged content is '
+                             'read from the git index instead of the working tree')
+    parser.add_argument('--git-diff', metavar='REV',
+                        help='Only process files changed relative to REV (with --git-staged: between REV '
+                             'and the index)')
+    parser.add_argument('--unmapped', action='store_true',
+                        help='After the run, list the characters that have no mapping with their Unicode '
+                             'names, counts, file counts and sample lines')
+    parser.add_argument('--unmapped-stubs', metavar='FILE',
+                        help='Also write mapping stubs for them to FILE, in Config/UnicodeReplacements.json format')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print wall and CPU time per phase, throughput and per-file latency percentiles')
+    parser.add_argument('--profile-stats', metavar='FILE',
+                        help='Also dump cProfile statistics of the main process to FILE (use --jobs 1 to '
+                             'include file processing; read with python -m pstats)')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='Also write a Chrome trace-event JSON of every phase to FILE')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.path is None and not args.files_from:
+        parser.error('the following arguments are required: path')
+    if args.files_from and (args.watch or args.git_staged or args.git_diff):
+        parser.error('--files-from cannot be combined with --watch, --git-staged or --git-diff')
+    if args.null and not args.files_from:
+        parser.error('-0 only applies to --files-from')
+    if args.fail_fast and not args.check:
+        parser.error('--fail-fast only applies to --check')
+    if args.check and (args.watch or args.cache is not None):
+        parser.error('--check cannot be combined with --watch or --cache')
+    if args.check:
+        # Nothing is written; staged checks read the index like previews
+        args.preview = True
+    if args.diff and (args.check or args.watch or args.cache is not None):
+        parser.error('--diff cannot be combined with --check, --watch or --cache')
+    if args.diff == '-' and args.report and not args.report_file:
+        parser.error('--diff and --report cannot both write to stdout; give one of them a file')
+    if args.diff:
+        args.preview = True
+    if args.unmapped_stubs:
+        args.unmapped = True
+    if args.unmapped and (args.watch or args.check or args.cache is not None):
+        # Files skipped by --cache are not read, so they could not be counted
+        parser.error('--unmapped cannot be combined with --watch, --check or --cache')
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.io_threads < 0:
+        parser.error('--io-threads cannot be negative')
+    if args.io_threads and args.watch:
+        parser.error('--io-threads cannot be combined with --watch')
+    if args.mapping:
+        global ENGINE
+        try:
+            ENGINE = load_engine(Path(args.mapping))
+        except (OSError, ValueError) as e:
+            print(f"Error loading mapping {args.mapping}: {e}")
+            return 1
+    if args.report and args.watch:
+        parser.error('--report cannot be combined with --watch')
+    if (args.git_staged or args.git_diff) and args.watch:
+        parser.error('--git-staged and --git-diff cannot be combined with --watch')
+    if args.profile_stats or args.trace:
+        args.profile = True
+    if args.profile and args.watch:
+        parser.error('--profile cannot be combined with --watch')
     
-    path = Path(args.path)
-    files_to_process = []
+    try:
+        if args.profile_stats:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                return _run_with_report(args)
+            finally:
+                profiler.disable()
+                profiler.dump_stats(args.profile_stats)
+        return _run_with_report(args)
+    finally:
+        # The summary is out; only now wait for chunks left running by an abort
+        _join_abandoned_pools()
+
+def _run_with_report(args: argparse.Namespace) -> int:
+    """_run, with the --report and --diff streams set up around it"""
+    if not args.report and not args.diff:
+        return _run(args)
+    with contextlib.ExitStack() as stack:
+        report = patch = None
+        if args.diff == '-':
+            patch = sys.stdout.buffer
+        elif args.diff:
+            try:
+                patch = stack.enter_context(open(args.diff, 'wb'))
+            except OSError as e:
+                print(f"Error opening diff file {args.diff}: {e}")
+                return 1
+        if args.report_file:
+            try:
+                report = ReportWriter(stack.enter_context(open(args.report_file, 'w', encoding='utf-8')), args.report)
+            except OSError as e:
+                print(f"Error opening report file {args.report_file}: {e}")
+                return 1
+        elif args.report:
+            report = ReportWriter(sys.stdout, args.report)
+        if args.diff == '-' or (args.report and not args.report_file):
+            stack.enter_context(contextlib.redirect_stdout(sys.stderr))
+        return _run(args, report, patch)
+
+def _run(args: argparse.Namespace, report: Optional[ReportWriter] = None, patch=None) -> int:
+    """Carry out a parsed command line, returning the exit code; patch receives --diff output"""
+    started = time.perf_counter()
+    path = Path(args.path or '.')
+    root = path if path.is_dir() else path.parent
+    backup_dir = None
+    if not args.sibling_backups:
+        backup_dir = str(Path(args.backup_dir) if args.backup_dir else root / BACKUP_DIRNAME)
     
-    if path.is_file():
-        files_to_process = [path]
-    elif path.is_dir():
-        if args.recursive:
-            files_to_process = list(path.rglob(args.pattern))
+    include = args.include or [args.pattern]
+    if args.watch:
+        if not path.is_dir():
+            print(f"Error: {path} is not a directory")
+            return 1
+        stats = watch(
+            path, include, args.exclude, args.recursive, not args.no_gitignore, args.jobs, args.debounce / 1000,
+            preview_only=args.preview,
+            create_backup=not args.no_backup,
+            stream_threshold=args.stream_threshold,
+            backup_dir=backup_dir,
+        )
+        print(f"Files processed: {stats['processed']}")
+        print(f"Files with Unicode: {stats['files_with_unicode']}")
+        print(f"Total replacements: {stats['replacements']}")
+        return 1 if stats['errors'] > 0 else 0
+    
+    # Staged previews scan blobs from the index; the working tree may differ
+    from_index = args.git_staged and args.preview
+    if not path.exists():
+        print(f"Error: {path} not found")
+        return 1
+    elif args.files_from:
+        if args.files_from != '-' and not os.path.isfile(args.files_from):
+            print(f"Error: file list {args.files_from} not found")
+            return 1
+        files_to_process = _listed_files(args.files_from, b'\0' if args.null else b'\n')
+    elif args.git_staged or args.git_diff:
+        try:
+            changed = git_changed_files(root, args.git_diff, args.git_staged)
+        except (OSError, RuntimeError) as e:
+            print(f"Error: {e}")
+            return 1
+        if path.is_file():
+            files_to_process = iter([filepath for filepath in changed if filepath == path])
         else:
-            files_to_process = list(path.glob(args.pattern))
+            files_to_process = filter_paths(changed, root, include, args.exclude, args.recursive)
+    elif path.is_file():
+        files_to_process = iter([path])
+    elif path.is_dir():
+        files_to_process = walk_files(path, include, args.exclude, args.recursive, not args.no_gitignore)
     else:
         print(f"Error: {path} not found")
         return 1
     
-    if not files_to_process:
-        print(f"No files matching pattern '{args.pattern}' found in {path}")
+    run_profile = None
+    phase = lambda name: _NO_PHASE
+    if args.profile:
+        run_profile = RunProfile(trace=bool(args.trace))
+        phase = run_profile.timer.phase
+        files_to_process = run_profile.iterate(files_to_process, 'walk')
+    histogram = UnmappedHistogram() if args.unmapped else None
+    
+    stats = {'processed': 0, 'files_with_unicode': 0, 'replacements': 0, 'errors': 0, 'cached': 0,
+             'bytes_in': 0, 'bytes_out': 0}
+    if patch is not None:
+        stats['diffed'] = 0
+    
+    cache = None
+    if args.cache is not None and not from_index:
+        cache = ScanCache(Path(args.cache) if args.cache else root / CACHE_FILENAME, root, ENGINE.fingerprint)
+        files_to_process = _skip_cached(files_to_process, cache, args.preview, stats, report)
+    
+    # Look ahead far enough to size the pool; a small tree does not need every core
+    lookahead = list(islice(files_to_process, args.jobs * 64))
+    if len(lookahead) < args.jobs * 64:
+        jobs = max(1, min(args.jobs, len(lookahead)))
+        chunksize = max(1, min(64, len(lookahead) // (jobs * 4)))
+    else:
+        jobs = args.jobs
+        chunksize = 16
+    if from_index:
+        # Blobs stream from one git process; the pool would only add pickling
+        jobs = 1
+    files_to_process = chain(lookahead, files_to_process)
+    
+    if not lookahead and not stats['cached']:
+        if args.files_from:
+            print(f"No files listed in {'stdin' if args.files_from == '-' else args.files_from}")
+        else:
+            print(f"No files matching pattern '{', '.join(include)}' found in {path}")
+        if report is not None:
+            report.close(_report_summary(stats, args.preview, started, args.check))
         return 0
     
     print(f"{'='*60}")
-    print(f"Unicode Replacement Tool - {'PREVIEW MODE' if args.preview else 'PROCESSING'}")
+    mode = 'CHECK MODE' if args.check else 'PREVIEW MODE' if args.preview else 'PROCESSING'
+    print(f"Unicode Replacement Tool - {mode}")
     print(f"{'='*60}")
     print(f"Path: {path}")
-    print(f"Files found: {len(files_to_process)}")
-    print(f"Pattern: {args.pattern}")
-    print(f"Backup: {'Disabled' if args.no_backup else 'Enabled'}")
-    print(f"{'='*60}\n")
+    if args.git_staged or args.git_diff:
+        source = 'staged' if args.git_staged else 'changed'
+        if args.git_diff:
+            source += f' since {args.git_diff}'
+        print(f"Files: {source} ({'git index' if from_index else 'working tree'})")
+    if args.files_from:
+        print(f"Files: listed in {'stdin' if args.files_from == '-' else args.files_from}")
+    else:
+        print(f"Pattern: {', '.join(include)}")
+    if args.exclude:
+        print(f"Exclude: {', '.join(args.exclude)}")
+    if args.no_backup:
+        print("Backup: Disabled")
+    else:
+        print(f"Backup: Enabled ({backup_dir or 'sibling .backup_ files'})")
     
-    total_replacements = 0
-    files_with_unicode = 0
-    errors = 0
+    print(f"Jobs: {jobs}")
+    if args.io_threads and not from_index:
+        print(f"I/O threads: {args.io_threads}")
+    if jobs > 1:
+        # Workers print too; whole lines keep the combined output readable
+        _line_buffer_stdout()
+    print(f"{'='*60}\n")
     
-    for filepath in files_to_process:
-        result = process_file(filepath, args.preview, not args.no_backup)
+    options = dict(
+        preview_only=args.preview,
+        create_backup=not args.no_backup,
+        stream_threshold=args.stream_threshold,
+        report_locations=10 if args.verbose else 0,
+        track_state=cache is not None,
+        backup_dir=backup_dir,
+        check_only=args.check,
+        sample_unmapped=args.unmapped,
+        diff=patch is not None,
+    )
+    if from_index:
+        results = (
+            (filepath, _process_timed(filepath, dict(options, data=data), args.profile))
+            for filepath, data in read_index_blobs(root, files_to_process)
+        )
+    elif args.io_threads:
+        results = process_files_pipelined(files_to_process, jobs, args.io_threads, profile=args.profile, **options)
+    else:
+        results = process_files(files_to_process, jobs, chunksize, profile=args.profile, **options)
+    stopped = False
+    for filepath, result in results:
+        stats['processed'] += 1
+        if cache is not None:
+            with phase('cache'):
+                cache.update(filepath, result)
+        if run_profile is not None:
+            run_profile.add(filepath, result)
+        if histogram is not None:
+            histogram.add(filepath, result)
+        if patch is not None and result and result['unicode_count'] and result['status'] == 'success':
+            if 'diff' not in result:
+                print(f"Warning: {filepath} - too large to diff (see --stream-threshold); not in the diff")
+            elif result['diff']:
+                patch.write(diff_header(filepath) + result.pop('diff'))
+                stats['diffed'] += 1
+        if report is not None:
+            report.write(report_record(filepath, result))
         
         if result:
-            if result['unicode_count'] > 0:
-                files_with_unicode += 1
-                total_replacements += result['unicode_count']
-                
+            stats['bytes_in'] += result.get('bytes_in', 0)
+            stats['bytes_out'] += result.get('bytes_out', 0)
+            if result['status'] == 'unicode_found':
+                stats['files_with_unicode'] += 1
+                line, column = result['first_non_ascii']
+                print(f"{filepath}:{line}:{column}: non-ASCII content")
+                if args.fail_fast:
+                    stopped = True
+                    break
+            elif result['unicode_count'] > 0:
+                stats['files_with_unicode'] += 1
+                stats['replacements'] += result['unicode_count']
                 if args.verbose or args.preview:
-                    print(f"\n{filepath}:")
-                    print(f"  Found {result['unicode_count']} Unicode characters")
-                    
-                    if args.preview:
-                        # Show sample replacements
-                        for char, replacement in result['replacements'][:5]:
-                            try:
-                                print(f"  {char} -> {replacement}")
-                            except UnicodeEncodeError:
-                                print(f"  [U+{ord(char):04X}] -> {replacement}")
-                        
-                        if len(result['replacements']) > 5:
-                            print(f"  ... and {len(result['replacements']) - 5} more unique replacements")
+                    _print_result(filepath, result, args.preview)
             
             if result['status'] == 'error' or result['status'] == 'write_error':
-                errors += 1
+                stats['errors'] += 1
+        else:
+            # Unreadable: a check must not pass on a file it never saw
+            stats['errors'] += 1
+    
+    # Cancels outstanding work when the loop stopped early
+    results.close()
+    
+    if cache is not None:
+        with phase('cache'):
+            # Only a walk of the whole tree has looked up every file that still exists
+            cache.save(prune=path.is_dir() and not (args.files_from or args.git_staged or args.git_diff))
+    if report is not None:
+        summary = _report_summary(stats, args.preview, started, args.check)
+        if histogram is not None:
+            summary['unmapped'] = histogram.top()
+        report.close(summary)
     
     # Summary
     print(f"\n{'='*60}")
     print("SUMMARY")
     print(f"{'='*60}")
-    print(f"Files processed: {len(files_to_process)}")
-    print(f"Files with Unicode: {files_with_unicode}")
-    print(f"Total replacements: {total_replacements}")
-    if errors > 0:
-        print(f"Errors: {errors}")
-    print(f"Status: {'Preview complete' if args.preview else 'Processing complete'}")
-    
-    return 1 if errors > 0 else 0
+    print(f"Files processed: {stats['processed']}")
+    if stats['cached']:
+        print(f"Files skipped (unchanged): {stats['cached']}")
+    print(f"Files with Unicode: {stats['files_with_unicode']}")
+    if not args.check:
+        print(f"Total replacements: {stats['replacements']}")
+    if stats['errors'] > 0:
+        print(f"Errors: {stats['errors']}")
+    if args.check:
+        print(f"Status: {'Check failed' if stats['files_with_unicode'] or stats['errors'] else 'Check passed'}"
+              f"{' (stopped at the first offending file)' if stopped else ''}")
+    else:
+        print(f"Status: {'Preview complete' if args.preview else 'Processing complete'}")
+    if patch is not None:
+        print(f"Diff: {stats['diffed']} files, written to {'stdout' if args.diff == '-' else args.diff}")
+    if args.git_staged and not args.preview and stats['files_with_unicode']:
+        print("Note: fixed files were changed in the working tree; 'git add' them again before committing")
+    
+    if histogram is not None:
+        histogram.print_summary()
+        if args.unmapped_stubs:
+            histogram.write_stubs(args.unmapped_stubs)
+            print(f"Mapping stubs written to {args.unmapped_stubs}")
+    
+    if run_profile is not None:
+        run_profile.print_summary()
+        if args.trace:
+            run_profile.write_trace(args.trace)
+            print(f"Trace written to {args.trace}")
+    
+    if args.check and stats['files_with_unicode']:
+        return EXIT_UNICODE_FOUND
+    return 1 if stats['errors'] > 0 else 0
 
 if __name__ == '__main__':
     sys.exit(main())
\ No newline at end of file